@@ -1,45 +1,36 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from app.schemas.item import Item, ItemCreate, ItemUpdate
 from app.schemas.pdf import PDFUploadResponse, ProcessingStatus, ChatRequest, ChatResponse, ContextChunk
-from app.utils.pdf_extractor import extract_pdf
-from app.utils.gemini_vision import analyze_pdf_images, GeminiVisionAnalyzer
+from app.utils.pdf_extractor import extract_pdf_parallel
+from app.utils.gemini_vision import (
+    analyze_pdf_images_async, GeminiVisionAnalyzer, get_analyzer, get_generative_model, NO_CONTEXT_ANSWER
+)
 from app.utils.semantic_chunker import chunk_pdf_extraction
 from app.utils.supabase_storage import get_storage_client
 from app.utils.pinecone_storage import get_pinecone_storage
-from app.utils.chat_storage import chat_storage
-from app.utils.query_classifier import QueryClassifier
-from app.utils.web_search import web_search
-from app.utils.deepgram_stt import create_deepgram_transcriber
-from app.core.config import settings
-from typing import List
-import google.generativeai as genai
-import uuid
-import aiofiles
-from pathlib import Path
-import logging
-import tempfile
-import os
-import json
-import asyncio
-from app.utils.pdf_extractor import extract_pdf
-from app.utils.gemini_vision import analyze_pdf_images, GeminiVisionAnalyzer
-from app.utils.semantic_chunker import chunk_pdf_extraction
-from app.utils.supabase_storage import get_storage_client
-from app.utils.pinecone_storage import get_pinecone_storage
-from app.utils.chat_storage import chat_storage
+from app.utils.chat_storage import get_chat_storage
 from app.utils.query_classifier import get_query_classifier
 from app.utils.web_search import get_web_searcher
-from app.utils.bm25_index import build_bm25_index
+from app.utils.bm25_index import build_bm25_index_async
 from app.utils.hybrid_search import hybrid_search, keyword_search_only
+from app.utils.deepgram_stt import create_deepgram_transcriber
 from app.core.config import settings
-from typing import List
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-import uuid
+import secrets
 import aiofiles
-from pathlib import Path
 import logging
 import tempfile
 import os
+import shutil
+import orjson
+import asyncio
+import functools
+import itertools
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -47,9 +38,89 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Size of each read when streaming uploads to disk (1 MiB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Interim transcripts are coalesced and sent at most once per this many seconds
+PARTIAL_TRANSCRIPT_DEBOUNCE = 0.05
+
+# Dedicated pool for CPU-heavy PDF steps (extraction, chunking)
+# so they never run on the event loop thread
+_PDF_EXECUTOR = ThreadPoolExecutor(
+    max_workers=min(os.cpu_count() or 1, 4),
+    thread_name_prefix="pdf-worker"
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_gemini_model() -> genai.GenerativeModel:
+    """Configure the Gemini SDK once and reuse a single model client"""
+    return get_generative_model(settings.GOOGLE_API_KEY, settings.GEMINI_MODEL)
+
+
+def _get_analyzer() -> GeminiVisionAnalyzer:
+    """Reuse a single Gemini analyzer for RAG answers (shared with image analysis)"""
+    return get_analyzer(settings.GOOGLE_API_KEY)
+
+
+# Upload progress per doc_id, updated by upload_pdf (single-process only;
+# oldest entries evicted past PROCESSING_STATUS_CACHE_SIZE)
+PROCESSING_STATUS_CACHE_SIZE = 1_000
+_processing_status: OrderedDict[str, ProcessingStatus] = OrderedDict()
+_processing_status_lock = asyncio.Lock()
+
+
+async def _set_processing_status(
+    doc_id: str,
+    status: str,
+    progress: Optional[float] = None,
+    message: Optional[str] = None
+):
+    """Record the current processing state of an uploaded document"""
+    async with _processing_status_lock:
+        _processing_status[doc_id] = ProcessingStatus(
+            doc_id=doc_id,
+            status=status,
+            progress=progress,
+            message=message
+        )
+        _processing_status.move_to_end(doc_id)
+        while len(_processing_status) > PROCESSING_STATUS_CACHE_SIZE:
+            _processing_status.popitem(last=False)
+
+
+# Whether a session has indexed documents: session_id -> (has_docs, expires_at)
+SESSION_DOCS_TTL_SECONDS = 60
+SESSION_DOCS_CACHE_SIZE = 10_000
+_session_docs: OrderedDict[str, Tuple[bool, float]] = OrderedDict()
+
+
+def _remember_session_docs(session_id: str, has_docs: bool):
+    """Cache whether a session has documents (primed on upload, cleared by empty retrievals)"""
+    _session_docs[session_id] = (has_docs, time.monotonic() + SESSION_DOCS_TTL_SECONDS)
+    _session_docs.move_to_end(session_id)
+    while len(_session_docs) > SESSION_DOCS_CACHE_SIZE:
+        _session_docs.popitem(last=False)
+
+
+def _session_has_docs(session_id: Optional[str]) -> bool:
+    """
+    Best-known answer to "does this session have documents?"
+    
+    Unknown or expired sessions are assumed to have documents; the next
+    document retrieval records the real answer.
+    """
+    if not session_id:
+        return False
+    entry = _session_docs.get(session_id)
+    if entry is None or entry[1] < time.monotonic():
+        return True
+    return entry[0]
+
+
 # In-memory storage for demonstration
 items_db = {}
-item_id_counter = 1
+_item_ids = itertools.count(1)  # next() is atomic, no global rebind needed
 
 
 @router.get("/items", response_model=List[Item], tags=["items"])
@@ -69,15 +140,14 @@ async def get_item(item_id: int):
 @router.post("/items", response_model=Item, status_code=201, tags=["items"])
 async def create_item(item: ItemCreate):
     """Create a new item"""
-    global item_id_counter
+    new_id = next(_item_ids)
     new_item = Item(
-        id=item_id_counter,
+        id=new_id,
         name=item.name,
         description=item.description,
         price=item.price
     )
-    items_db[item_id_counter] = new_item
-    item_id_counter += 1
+    items_db[new_id] = new_item
     return new_item
 
 
@@ -146,11 +216,16 @@ async def upload_pdf(
             detail="Only PDF files are accepted"
         )
     
+    doc_id = None
+    temp_dir = None
     try:
         # Generate unique document ID and session ID if not provided
-        doc_id = str(uuid.uuid4())[:8]
+        # (72 / 96 random bits, URL-safe so they work in storage paths)
+        doc_id = secrets.token_urlsafe(9)
         if not session_id:
-            session_id = str(uuid.uuid4())[:12]  # Generate session ID
+            session_id = secrets.token_urlsafe(12)  # Generate session ID
+        
+        await _set_processing_status(doc_id, "processing", 0.0, "Uploading PDF")
         
         logger.info(f"Processing PDF - doc_id: {doc_id}, session_id: {session_id}")
         
@@ -158,42 +233,60 @@ async def upload_pdf(
         temp_dir = tempfile.mkdtemp()
         temp_pdf_path = os.path.join(temp_dir, f"{doc_id}_{file.filename}")
         
-        # Save file content
-        content = await file.read()
+        # Stream file content to disk in fixed-size chunks (memory stays O(chunk))
+        max_upload_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+        bytes_written = 0
         async with aiofiles.open(temp_pdf_path, 'wb') as out_file:
-            await out_file.write(content)
-        
-        logger.info(f"PDF saved temporarily: {temp_pdf_path}")
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                bytes_written += len(chunk)
+                if bytes_written > max_upload_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"PDF exceeds maximum upload size of {settings.MAX_UPLOAD_SIZE_MB} MB"
+                    )
+                await out_file.write(chunk)
+
+        logger.info(f"PDF saved temporarily: {temp_pdf_path} ({bytes_written} bytes)")
         
-        # Upload PDF to Supabase Storage
+        # Upload PDF to Supabase Storage and extract text/images concurrently
+        # (network-bound upload overlaps with CPU-bound extraction)
         storage_client = get_storage_client()
         pdf_storage_path = f"pdfs/{doc_id}/{file.filename}"
-        pdf_upload_result = storage_client.upload_file(
-            file_path=temp_pdf_path,
-            storage_path=pdf_storage_path,
-            content_type='application/pdf'
+        upload_task = asyncio.create_task(asyncio.to_thread(
+            storage_client.upload_file,
+            temp_pdf_path,
+            pdf_storage_path,
+            'application/pdf'
+        ))
+        # Pages are extracted in parallel by a process pool; images are
+        # uploaded to Supabase automatically during extraction
+        extract_task = asyncio.create_task(asyncio.to_thread(
+            extract_pdf_parallel,
+            temp_pdf_path,
+            doc_id,
+            True  # use_supabase
+        ))
+        pdf_upload_result, extraction_result = await asyncio.gather(
+            upload_task,
+            extract_task,
+            return_exceptions=True
         )
+
+        # Surface the first failure only after both tasks have finished
+        for outcome in (pdf_upload_result, extraction_result):
+            if isinstance(outcome, BaseException):
+                raise outcome
+
         logger.info(f"✓ PDF uploaded to Supabase: {pdf_upload_result['url']}")
-        
-        # Extract text and images (images will be uploaded to Supabase automatically)
-        extraction_result = extract_pdf(
-            pdf_path=temp_pdf_path,
-            doc_id=doc_id,
-            use_supabase=True  # Upload images to Supabase
-        )
-        
+
         # Add PDF URL and session info to extraction result
         extraction_result['pdf_url'] = pdf_upload_result['url']
         extraction_result['pdf_storage_path'] = pdf_upload_result['path']
         extraction_result['session_id'] = session_id
         extraction_result['filename'] = file.filename
         
-        # Clean up temp file
-        try:
-            os.remove(temp_pdf_path)
-            os.rmdir(temp_dir)
-        except:
-            pass
+        # Temp PDF is no longer needed once uploaded and extracted
+        shutil.rmtree(temp_dir, ignore_errors=True)
         
         # Count total images
         total_images = sum(len(page['images']) for page in extraction_result['pages'])
@@ -201,11 +294,13 @@ async def upload_pdf(
         logger.info(f"Extraction complete for {doc_id}: "
                    f"{extraction_result['total_pages']} pages, {total_images} images")
         
+        await _set_processing_status(doc_id, "processing", 30.0, "Analyzing images")
+        
         # Analyze images with Gemini Vision if API key is configured
         if settings.GOOGLE_API_KEY and total_images > 0:
             try:
                 logger.info(f"Starting Gemini vision analysis for {total_images} images")
-                extraction_result = analyze_pdf_images(
+                extraction_result = await analyze_pdf_images_async(
                     extraction_result,
                     api_key=settings.GOOGLE_API_KEY
                 )
@@ -216,28 +311,40 @@ async def upload_pdf(
             logger.warning("GOOGLE_API_KEY not set - skipping image analysis")
         
         # Add SEMANTIC or PAGE-WISE chunking WITH EMBEDDINGS
+        await _set_processing_status(doc_id, "processing", 50.0, "Chunking and embedding text")
+        loop = asyncio.get_running_loop()
         logger.info(f"Starting {chunking_strategy.upper()} chunking with embeddings")
-        extraction_result = chunk_pdf_extraction(
-            extraction_result,
-            strategy=chunking_strategy,
-            max_chunk_size=1500,
-            min_chunk_size=300,
-            generate_embeddings=True
+        extraction_result = await loop.run_in_executor(
+            _PDF_EXECUTOR,
+            functools.partial(
+                chunk_pdf_extraction,
+                extraction_result,
+                strategy=chunking_strategy,
+                max_chunk_size=1500,
+                min_chunk_size=300,
+                generate_embeddings=True
+            )
         )
         total_chunks = extraction_result.get('total_chunks', 0)
         logger.info(f"✓ Created {total_chunks} {chunking_strategy.upper()} chunks with embeddings")
         
         # Store in Pinecone
+        await _set_processing_status(doc_id, "processing", 70.0, "Storing vectors")
         logger.info("Storing vectors in Pinecone...")
         pinecone_storage = get_pinecone_storage()
-        storage_result = pinecone_storage.store_document(
+        storage_result = await asyncio.to_thread(
+            pinecone_storage.store_document_parallel,
             extraction_result,
-            namespace=None  # Use default namespace
+            None,  # Use default namespace
+            batch_size=100,
+            pool_threads=8
         )
         logger.info(f"✓ Stored {storage_result['total_vectors']} vectors in Pinecone")
         logger.info(f"✓ Session ID for this upload: {storage_result['session_id']}")
+        _remember_session_docs(session_id, True)
         
         # Build BM25 index for keyword search (in-memory, FREE)
+        await _set_processing_status(doc_id, "processing", 90.0, "Building keyword index")
         logger.info("Building BM25 index for keyword search...")
         chunks = extraction_result.get('chunks', [])
         logger.info(f"Found {len(chunks)} chunks to index")
@@ -245,12 +352,17 @@ async def upload_pdf(
         if not chunks:
             logger.warning("⚠ No chunks found - BM25 index not built")
         else:
-            bm25_success = build_bm25_index(storage_result['session_id'], chunks)
+            bm25_success = await build_bm25_index_async(
+                storage_result['session_id'],
+                chunks
+            )
             if bm25_success:
                 logger.info(f"✓ Built BM25 index with {len(chunks)} chunks for session {storage_result['session_id']}")
             else:
                 logger.warning("⚠ Failed to build BM25 index (keyword search disabled)")
         
+        await _set_processing_status(doc_id, "completed", 100.0, "Processing completed successfully")
+        
         # Add storage info to response
         extraction_result['pinecone_storage'] = storage_result
         
@@ -271,8 +383,14 @@ async def upload_pdf(
             total_images=total_images,
             extraction_result=extraction_result
         )
-        
+
+    except HTTPException as e:
+        if doc_id:
+            await _set_processing_status(doc_id, "failed", message=str(e.detail))
+        raise
     except Exception as e:
+        if doc_id:
+            await _set_processing_status(doc_id, "failed", message=str(e))
         logger.error(f"Error processing PDF: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
@@ -280,6 +398,10 @@ async def upload_pdf(
             status_code=500,
             detail=f"Error processing PDF: {str(e)}"
         )
+    finally:
+        # Always reclaim the temp dir, including when processing failed early
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 @router.get("/processing-status/{doc_id}", response_model=ProcessingStatus, tags=["pdf"])
@@ -293,33 +415,131 @@ async def get_processing_status(doc_id: str):
     Returns:
         ProcessingStatus with current status
     """
-    # This is a simple implementation
-    # In production, you'd track status in a database or cache
+    # Status is tracked in-process by upload_pdf; a multi-worker deployment
+    # would need a shared store (e.g. Redis) instead
+    status = _processing_status.get(doc_id)
     
-    pdf_path = Path(f"uploads/pdfs") / f"{doc_id}_*.pdf"
-    
-    # Check if PDF exists (simple check)
-    import glob
-    matching_files = glob.glob(str(pdf_path))
-    
-    if not matching_files:
+    if status is None:
         raise HTTPException(
             status_code=404,
             detail=f"Document {doc_id} not found"
         )
     
-    return ProcessingStatus(
-        doc_id=doc_id,
-        status="completed",
-        progress=100.0,
-        message="Processing completed successfully"
-    )
+    return status
 
 
 # ============================================
 # CHAT / RAG ENDPOINTS
 # ============================================
 
+
+def _classify_query(request: ChatRequest) -> str:
+    """Classify a chat query as greeting, document or web_search"""
+    classifier = get_query_classifier()
+    
+    # Check if user has documents (cached from uploads and earlier retrievals)
+    has_documents = _session_has_docs(request.session_id)
+    
+    classification = classifier.classify(request.query, has_documents)
+    query_type = classification['type']
+    
+    # Override classification if user explicitly enabled web search
+    if request.enable_web_search and query_type == 'document':
+        # Re-check if query might benefit from web search
+        if not any(keyword in request.query.lower() for keyword in ['document', 'pdf', 'page', 'text', 'chapter', 'section']):
+            query_type = 'web_search'
+            logger.info(f"Overriding to web_search due to enable_web_search flag")
+    
+    logger.info(f"Query classified as: {query_type} (confidence: {classification['confidence']:.2f}) - {classification['reason']}")
+    
+    return query_type
+
+
+def _retrieve_context(request: ChatRequest) -> List[dict]:
+    """Retrieve relevant chunks for a document question based on search_mode"""
+    logger.info(f"🔍 Searching with mode '{request.search_mode}' (session: {request.session_id})")
+    
+    if request.search_mode == 'keyword':
+        # Pure BM25 keyword search
+        results = keyword_search_only(
+            session_id=request.session_id,
+            query=request.query,
+            top_k=request.top_k
+        )
+        logger.info(f"✓ BM25 keyword search: {len(results)} results")
+        
+    elif request.search_mode == 'hybrid':
+        # Hybrid: BM25 + Vector with RRF fusion
+        results = hybrid_search(
+            session_id=request.session_id,
+            query=request.query,
+            top_k=request.top_k,
+            bm25_weight=0.4,
+            vector_weight=0.6
+        )
+        logger.info(f"✓ Hybrid search (BM25+Vector): {len(results)} results")
+        
+    else:  # 'vector' (default)
+        # Traditional vector search
+        results = get_pinecone_storage().query(
+            query_text=request.query,
+            top_k=request.top_k,
+            session_id=request.session_id,
+            include_text=True
+        )
+        logger.info(f"✓ Vector search: {len(results)} results")
+    
+    return results
+
+
+def _format_context_chunks(results: List[dict]) -> List[ContextChunk]:
+    """Convert retrieval results into response context chunks"""
+    return [
+        ContextChunk(
+            text=result.get('text', ''),
+            score=result.get('score', 0.0),
+            doc_id=result.get('metadata', {}).get('doc_id', ''),
+            page_num=result.get('page_num'),
+            pdf_url=result.get('pdf_url'),
+            type=result.get('type', 'text_chunk')
+        )
+        for result in results
+    ]
+
+
+def _document_turn_messages(
+    request: ChatRequest,
+    answer: str,
+    results: List[dict],
+    sources: List[dict],
+    model: str
+) -> List[dict]:
+    """Build the user + assistant rows saved after a document answer (model: the one that answered)"""
+    return [
+        {
+            'session_id': request.session_id,
+            'role': 'user',
+            'message': request.query
+        },
+        {
+            'session_id': request.session_id,
+            'role': 'assistant',
+            'message': answer,
+            'metadata': {
+                'num_chunks': len(results),
+                'sources': sources,
+                'model': model,
+                'query_type': 'document'
+            }
+        }
+    ]
+
+
+def _sse(payload: dict) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+
 @router.post("/chat", response_model=ChatResponse, tags=["chat"])
 async def chat_with_documents(request: ChatRequest):
     """
@@ -337,27 +557,19 @@ async def chat_with_documents(request: ChatRequest):
     Returns:
         ChatResponse with generated answer, context, and sources
     """
+    return await _chat_with_documents(request)
+
+
+async def _chat_with_documents(request: ChatRequest, query_type: Optional[str] = None) -> ChatResponse:
+    """/chat handler; query_type is classified here unless the caller already did"""
     try:
         logger.info(f"Chat query: '{request.query}' (session: {request.session_id}, web_search: {request.enable_web_search})")
         
         # 1. Classify the query
         classifier = get_query_classifier()
-        
-        # Check if user has documents (we'll check if Pinecone returns results)
-        # For now, assume they have docs if session_id is provided
-        has_documents = bool(request.session_id)
-        
-        classification = classifier.classify(request.query, has_documents)
-        query_type = classification['type']
-        
-        # Override classification if user explicitly enabled web search
-        if request.enable_web_search and query_type == 'document':
-            # Re-check if query might benefit from web search
-            if not any(keyword in request.query.lower() for keyword in ['document', 'pdf', 'page', 'text', 'chapter', 'section']):
-                query_type = 'web_search'
-                logger.info(f"Overriding to web_search due to enable_web_search flag")
-        
-        logger.info(f"Query classified as: {query_type} (confidence: {classification['confidence']:.2f}) - {classification['reason']}")
+        if query_type is None:
+            query_type = _classify_query(request)
+        chat_storage = get_chat_storage()
         
         # 2. Handle based on query type
         
@@ -366,18 +578,10 @@ async def chat_with_documents(request: ChatRequest):
             answer = classifier.get_greeting_response(request.query)
             
             # Save messages
-            chat_storage.save_message(
-                session_id=request.session_id,
-                role="user",
-                message=request.query
-            )
-            
-            chat_storage.save_message(
-                session_id=request.session_id,
-                role="assistant",
-                message=answer,
-                metadata={'query_type': 'greeting'}
-            )
+            await chat_storage.save_messages_async([
+                {'session_id': request.session_id, 'role': 'user', 'message': request.query},
+                {'session_id': request.session_id, 'role': 'assistant', 'message': answer, 'metadata': {'query_type': 'greeting'}}
+            ])
             
             return ChatResponse(
                 answer=answer,
@@ -390,13 +594,20 @@ async def chat_with_documents(request: ChatRequest):
         # === WEB SEARCH HANDLER ===
         elif query_type == 'web_search':
             web_searcher = get_web_searcher()
-            search_results = web_searcher.search(request.query, num_results=5)
+            
+            # Run the web search and load chat history concurrently
+            search_results, chat_history = await asyncio.gather(
+                asyncio.to_thread(web_searcher.search, request.query, num_results=5),
+                chat_storage.get_recent_context_async(request.session_id, num_turns=3)
+            )
             
             if not search_results['success']:
                 answer = f"I'd like to search the web for that, but web search is not configured. {search_results.get('error', '')}"
                 
-                chat_storage.save_message(session_id=request.session_id, role="user", message=request.query)
-                chat_storage.save_message(session_id=request.session_id, role="assistant", message=answer)
+                await chat_storage.save_messages_async([
+                    {'session_id': request.session_id, 'role': 'user', 'message': request.query},
+                    {'session_id': request.session_id, 'role': 'assistant', 'message': answer}
+                ])
                 
                 return ChatResponse(
                     answer=answer,
@@ -409,18 +620,11 @@ async def chat_with_documents(request: ChatRequest):
             # Format web results as context
             web_context = web_searcher.format_results_for_context(search_results['results'])
             
-            # Load chat history
-            chat_history = chat_storage.get_recent_context(session_id=request.session_id, num_turns=3)
-            
-            # Save user message
-            chat_storage.save_message(session_id=request.session_id, role="user", message=request.query)
-            
             # Generate answer with Gemini
             if not settings.GOOGLE_API_KEY:
                 raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not configured")
             
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
+            model = _get_gemini_model()
             
             # Build history text
             history_text = ""
@@ -449,19 +653,22 @@ Instructions:
 
 Answer (use markdown formatting):"""
             
-            response = model.generate_content(prompt)
+            response = await asyncio.to_thread(model.generate_content, prompt)
             answer = response.text
             
-            # Save assistant response
-            chat_storage.save_message(
-                session_id=request.session_id,
-                role="assistant",
-                message=answer,
-                metadata={
-                    'query_type': 'web_search',
-                    'num_results': len(search_results['results'])
+            # Save user message and assistant response in one insert
+            await chat_storage.save_messages_async([
+                {'session_id': request.session_id, 'role': 'user', 'message': request.query},
+                {
+                    'session_id': request.session_id,
+                    'role': 'assistant',
+                    'message': answer,
+                    'metadata': {
+                        'query_type': 'web_search',
+                        'num_results': len(search_results['results'])
+                    }
                 }
-            )
+            ])
             
             # Format sources
             sources = []
@@ -482,60 +689,30 @@ Answer (use markdown formatting):"""
         
         # === DOCUMENT RAG HANDLER ===
         else:  # query_type == 'document'
-            # 1. Retrieve relevant context based on search_mode
-            logger.info(f"🔍 Searching with mode '{request.search_mode}' (session: {request.session_id})")
-            
-            pinecone_storage = get_pinecone_storage()
-            
-            # Route based on search mode
-            if request.search_mode == 'keyword':
-                # Pure BM25 keyword search
-                results = keyword_search_only(
-                    session_id=request.session_id,
-                    query=request.query,
-                    top_k=request.top_k
-                )
-                logger.info(f"✓ BM25 keyword search: {len(results)} results")
-                
-            elif request.search_mode == 'hybrid':
-                # Hybrid: BM25 + Vector with RRF fusion
-                results = hybrid_search(
-                    session_id=request.session_id,
-                    query=request.query,
-                    top_k=request.top_k,
-                    bm25_weight=0.4,
-                    vector_weight=0.6
-                )
-                logger.info(f"✓ Hybrid search (BM25+Vector): {len(results)} results")
-                
-            else:  # 'vector' (default)
-                # Traditional vector search
-                results = pinecone_storage.query(
-                    query_text=request.query,
-                    top_k=request.top_k,
-                    session_id=request.session_id,
-                    include_text=True
-                )
-                logger.info(f"✓ Vector search: {len(results)} results")
+            # 1. Retrieve relevant context based on search_mode while
+            #    loading conversation history from Supabase
+            chat_history, results = await asyncio.gather(
+                chat_storage.get_recent_context_async(
+                    request.session_id,
+                    num_turns=5  # Last 5 conversation turns
+                ),
+                asyncio.to_thread(_retrieve_context, request)
+            )
             
             if not results:
+                if request.search_mode not in ('keyword', 'hybrid'):
+                    # A successful vector query (errors raise) only comes back empty
+                    # when the session has no vectors; hybrid search swallows
+                    # Pinecone errors, so its empty result proves nothing
+                    _remember_session_docs(request.session_id, False)
                 # No context found - save the query and return helpful message
-                chat_storage.save_message(
-                    session_id=request.session_id,
-                    role="user",
-                    message=request.query
-                )
-                
-                no_context_answer = "I couldn't find any relevant information in the uploaded documents for this session. Please make sure you've uploaded documents first."
-                
-                chat_storage.save_message(
-                    session_id=request.session_id,
-                    role="assistant",
-                    message=no_context_answer
-                )
+                await chat_storage.save_messages_async([
+                    {'session_id': request.session_id, 'role': 'user', 'message': request.query},
+                    {'session_id': request.session_id, 'role': 'assistant', 'message': NO_CONTEXT_ANSWER}
+                ])
                 
                 return ChatResponse(
-                    answer=no_context_answer,
+                    answer=NO_CONTEXT_ANSWER,
                     context=[],
                     session_id=request.session_id,
                     query=request.query,
@@ -543,36 +720,22 @@ Answer (use markdown formatting):"""
                 )
             
             logger.info(f"✓ Retrieved {len(results)} relevant chunks from Pinecone")
-            
-            # 2. Load conversation history from Supabase
-            chat_history = chat_storage.get_recent_context(
-                session_id=request.session_id,
-                num_turns=5  # Last 5 conversation turns
-            )
-            
             logger.info(f"✓ Loaded {len(chat_history)} messages from history")
             
-            # 3. Save user message to Supabase
-            chat_storage.save_message(
-                session_id=request.session_id,
-                role="user",
-                message=request.query
-            )
-            
-            # 4. Generate answer using Gemini with context and history
+            # 2. Generate answer using Gemini with context and history
             if not settings.GOOGLE_API_KEY:
                 raise HTTPException(
                     status_code=500,
                     detail="GOOGLE_API_KEY not configured"
                 )
             
-            gemini = GeminiVisionAnalyzer(api_key=settings.GOOGLE_API_KEY)
+            gemini = _get_analyzer()
             
-            response_data = gemini.chat_with_context(
+            response_data = await gemini.chat_with_context_async(
                 query=request.query,
                 context_chunks=results,
                 chat_history=chat_history,
-                max_context_length=8000
+                max_context_tokens=4000
             )
             
             if not response_data['success']:
@@ -583,30 +746,13 @@ Answer (use markdown formatting):"""
             
             logger.info(f"✓ Generated answer ({len(answer)} chars) with {len(sources)} sources")
             
-            # 5. Save assistant response to Supabase
-            chat_storage.save_message(
-                session_id=request.session_id,
-                role="assistant",
-                message=answer,
-                metadata={
-                    'num_chunks': len(results),
-                    'sources': sources,
-                    'model': 'gemini-2.0-flash-exp',
-                    'query_type': 'document'
-                }
+            # 3. Save user message and assistant response to Supabase in one insert
+            await chat_storage.save_messages_async(
+                _document_turn_messages(request, answer, results, sources, response_data['model'])
             )
             
-            # 6. Format context chunks for response
-            context_chunks = []
-            for result in results:
-                context_chunks.append(ContextChunk(
-                    text=result.get('text', ''),
-                    score=result.get('score', 0.0),
-                    doc_id=result.get('metadata', {}).get('doc_id', ''),
-                    page_num=result.get('page_num'),
-                    pdf_url=result.get('pdf_url'),
-                    type=result.get('type', 'text_chunk')
-                ))
+            # 4. Format context chunks for response
+            context_chunks = _format_context_chunks(results)
             
             return ChatResponse(
                 answer=answer,
@@ -626,6 +772,127 @@ Answer (use markdown formatting):"""
         )
 
 
+@router.post("/chat/stream", tags=["chat"])
+async def chat_with_documents_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events
+    
+    Document questions stream the Gemini answer while it is generated.
+    Greetings and web search queries are answered by /chat and sent whole.
+    
+    Events:
+    - {"sources": [...]} for document answers, before the first fragment
+      (the pages included in the prompt context)
+    - {"delta": "..."} for each fragment of the answer
+    - {"done": true, "answer": ..., "sources": [...], "context": [...]} at the end,
+      with citations converted to links
+    - {"error": "..."} if the answer could not be generated
+    
+    Args:
+        request: ChatRequest with query and session_id
+        
+    Returns:
+        StreamingResponse with text/event-stream content
+    """
+    logger.info(f"Streaming chat query: '{request.query}' (session: {request.session_id}, web_search: {request.enable_web_search})")
+    
+    query_type = _classify_query(request)
+    
+    async def generate():
+        try:
+            chat_storage = get_chat_storage()
+            
+            if query_type != 'document':
+                response = await _chat_with_documents(request, query_type)
+                yield _sse({'delta': response.answer})
+                yield _sse({
+                    'done': True,
+                    'answer': response.answer,
+                    'sources': [source.model_dump() for source in response.sources],
+                    'context': []
+                })
+                return
+            
+            if not settings.GOOGLE_API_KEY:
+                yield _sse({'error': "GOOGLE_API_KEY not configured"})
+                return
+            
+            chat_history, results = await asyncio.gather(
+                chat_storage.get_recent_context_async(request.session_id, num_turns=5),
+                asyncio.to_thread(_retrieve_context, request)
+            )
+            
+            if not results:
+                if request.search_mode not in ('keyword', 'hybrid'):
+                    # A successful vector query (errors raise) only comes back empty
+                    # when the session has no vectors; hybrid search swallows
+                    # Pinecone errors, so its empty result proves nothing
+                    _remember_session_docs(request.session_id, False)
+                chat_storage.save_messages_background([
+                    {'session_id': request.session_id, 'role': 'user', 'message': request.query},
+                    {'session_id': request.session_id, 'role': 'assistant', 'message': NO_CONTEXT_ANSWER}
+                ])
+                yield _sse({'delta': NO_CONTEXT_ANSWER})
+                yield _sse({'done': True, 'answer': NO_CONTEXT_ANSWER, 'sources': [], 'context': []})
+                return
+            
+            gemini = _get_analyzer()
+            
+            # Sources are known before generation (pages the context will
+            # include), so send them up front
+            sources = gemini.context_sources(results, max_context_tokens=4000)
+            yield _sse({'sources': sources})
+            
+            events = gemini.chat_with_context_events(
+                query=request.query,
+                context_chunks=results,
+                chat_history=chat_history,
+                max_context_tokens=4000,
+                sources=sources
+            )
+            
+            # Pull each fragment on a worker thread so the blocking SDK
+            # iterator never stalls the event loop; the last event carries
+            # the finished answer (served whole from the answer cache on a repeat)
+            response_data = None
+            while (event := await asyncio.to_thread(next, events, None)) is not None:
+                delta, response_data = event
+                if delta:
+                    yield _sse({'delta': delta})
+            
+            if response_data is None:
+                logger.error("Streaming chat produced no response")
+                yield _sse({'error': "Error generating answer: empty response"})
+                return
+            
+            answer = response_data['answer']
+            
+            logger.info(f"✓ Streamed answer ({len(answer)} chars) with {len(sources)} sources")
+            
+            # Save both messages once the full answer is known; the insert
+            # runs in the background so the final frame isn't held up
+            chat_storage.save_messages_background(
+                _document_turn_messages(request, answer, results, sources, response_data['model'])
+            )
+            
+            yield _sse({
+                'done': True,
+                'answer': answer,
+                'sources': sources,
+                'context': [chunk.model_dump() for chunk in _format_context_chunks(results)]
+            })
+            
+        except Exception as e:
+            logger.error(f"Error in streaming chat endpoint: {str(e)}")
+            yield _sse({'error': f"Error generating answer: {str(e)}"})
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.delete("/items/{item_id}", status_code=204, tags=["items"])
 async def delete_item(item_id: int):
     """Delete an item"""
@@ -639,11 +906,18 @@ async def delete_item(item_id: int):
 # DEBUG ENDPOINTS
 # ============================================
 
+# Dummy query vector for sampling the index in the debug endpoint
+_ZERO_VEC = [0.0] * settings.EMBEDDING_DIMENSIONS
+
+
 @router.get("/debug/pinecone-stats", tags=["debug"])
-async def get_pinecone_stats(session_id: str = None):
+async def get_pinecone_stats(session_id: str = None, deep: bool = False):
     """
     Get Pinecone index statistics and sample vectors
     Helps debug session_id issues
+    
+    Sampling vectors across all sessions runs an extra unfiltered query,
+    so it only happens when deep=true.
     """
     try:
         pinecone_storage = get_pinecone_storage()
@@ -667,10 +941,11 @@ async def get_pinecone_stats(session_id: str = None):
             )
             result["session_query_results"] = len(results)
             result["session_id_tested"] = session_id
-            
+        
+        if session_id and deep:
             # Also try without session filter to see what's actually in DB
             all_results = pinecone_storage.index.query(
-                vector=[0.0] * 1024,  # dummy vector
+                vector=_ZERO_VEC,
                 top_k=10,
                 include_metadata=True
             )
@@ -706,6 +981,11 @@ async def get_pinecone_stats(session_id: str = None):
 # WEBSOCKET ENDPOINTS - VOICE TRANSCRIPTION
 # ============================================
 
+async def _send_json(websocket: WebSocket, payload: dict):
+    """Send a JSON text frame encoded with orjson (client parses text frames)"""
+    await websocket.send_text(orjson.dumps(payload).decode())
+
+
 @router.websocket("/ws/transcribe")
 async def websocket_transcribe(websocket: WebSocket):
     """
@@ -717,11 +997,14 @@ async def websocket_transcribe(websocket: WebSocket):
     await websocket.accept()
     logger.info(f"✅ WebSocket connection established from {websocket.client}")
     
+    loop = asyncio.get_running_loop()
     transcriber = None
     transcript_buffer = []
     keepalive_task = None
+    partial_flush_task = None
+    latest_partial = None
     audio_chunks_received = 0
-    last_audio_time = asyncio.get_event_loop().time()
+    last_audio_time = loop.time()
     
     async def send_keepalive():
         """Send periodic ping to keep connection alive"""
@@ -729,9 +1012,9 @@ async def websocket_transcribe(websocket: WebSocket):
             while True:
                 await asyncio.sleep(30)  # Ping every 30 seconds
                 try:
-                    await websocket.send_json({
+                    await _send_json(websocket, {
                         "type": "ping",
-                        "timestamp": asyncio.get_event_loop().time()
+                        "timestamp": loop.time()
                     })
                     logger.debug("💓 Sent keepalive ping")
                 except Exception as e:
@@ -748,22 +1031,50 @@ async def websocket_transcribe(websocket: WebSocket):
         transcriber = create_deepgram_transcriber()
         logger.info("🎤 Initializing Deepgram transcriber...")
         
+        async def send_transcript(text: str, is_final: bool):
+            await _send_json(websocket, {
+                "type": "transcript",
+                "text": text,
+                "is_final": is_final,
+                "timestamp": loop.time()
+            })
+        
+        async def flush_partial():
+            """Send only the newest interim transcript after the debounce window"""
+            nonlocal partial_flush_task, latest_partial
+            try:
+                await asyncio.sleep(PARTIAL_TRANSCRIPT_DEBOUNCE)
+                text, latest_partial = latest_partial, None
+                partial_flush_task = None
+                if text is not None:
+                    await send_transcript(text, False)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"❌ Error sending transcript: {e}")
+        
         # Callback for transcripts
         async def on_transcript(text: str, is_final: bool):
             """Send transcript back to client"""
+            nonlocal partial_flush_task, latest_partial
             try:
-                await websocket.send_json({
-                    "type": "transcript",
-                    "text": text,
-                    "is_final": is_final,
-                    "timestamp": asyncio.get_event_loop().time()
-                })
-                
-                if is_final:
-                    transcript_buffer.append(text)
-                    logger.info(f"📝 Final transcript: {text}")
-                else:
+                if not is_final:
+                    # Coalesce bursts of interim results into one frame
+                    latest_partial = text
+                    if partial_flush_task is None:
+                        partial_flush_task = asyncio.create_task(flush_partial())
                     logger.debug(f"⏳ Interim transcript: {text[:50]}...")
+                    return
+                
+                # A final result supersedes any interim one still pending
+                if partial_flush_task is not None:
+                    partial_flush_task.cancel()
+                    partial_flush_task = None
+                latest_partial = None
+                
+                await send_transcript(text, True)
+                transcript_buffer.append(text)
+                logger.info(f"📝 Final transcript: {text}")
                     
             except Exception as e:
                 logger.error(f"❌ Error sending transcript: {e}")
@@ -773,7 +1084,7 @@ async def websocket_transcribe(websocket: WebSocket):
             """Send error to client"""
             try:
                 logger.error(f"❌ Transcription error: {error_msg}")
-                await websocket.send_json({
+                await _send_json(websocket, {
                     "type": "error",
                     "message": error_msg
                 })
@@ -792,7 +1103,7 @@ async def websocket_transcribe(websocket: WebSocket):
         
         if not success:
             logger.error("❌ Failed to start Deepgram transcription service")
-            await websocket.send_json({
+            await _send_json(websocket, {
                 "type": "error",
                 "message": "Failed to start Deepgram transcription service"
             })
@@ -800,7 +1111,7 @@ async def websocket_transcribe(websocket: WebSocket):
             return
         
         # Send ready message
-        await websocket.send_json({
+        await _send_json(websocket, {
             "type": "ready",
             "message": "Transcription service ready. Start speaking!"
         })
@@ -815,10 +1126,10 @@ async def websocket_transcribe(websocket: WebSocket):
                 if "bytes" in data:
                     # Audio data - send to Deepgram
                     audio_chunk = data["bytes"]
-                    await transcriber.send_audio(audio_chunk)
+                    transcriber.enqueue_audio(audio_chunk)
                     
                     audio_chunks_received += 1
-                    last_audio_time = asyncio.get_event_loop().time()
+                    last_audio_time = loop.time()
                     
                     # Log progress every 100 chunks
                     if audio_chunks_received % 100 == 0:
@@ -826,14 +1137,14 @@ async def websocket_transcribe(websocket: WebSocket):
                     
                 elif "text" in data:
                     # Control message
-                    message = json.loads(data["text"])
+                    message = orjson.loads(data["text"])
                     command = message.get("command")
                     
                     if command == "stop":
                         # Stop transcription and return full transcript
                         full_transcript = " ".join(transcript_buffer)
                         
-                        await websocket.send_json({
+                        await _send_json(websocket, {
                             "type": "complete",
                             "full_transcript": full_transcript,
                             "total_chunks": audio_chunks_received
@@ -843,19 +1154,19 @@ async def websocket_transcribe(websocket: WebSocket):
                         logger.info(f"✅ Transcript completed: {full_transcript[:100]}... ({audio_chunks_received} chunks)")
                     
                     elif command == "ping":
-                        await websocket.send_json({
+                        await _send_json(websocket, {
                             "type": "pong",
-                            "timestamp": asyncio.get_event_loop().time()
+                            "timestamp": loop.time()
                         })
                         logger.debug("💓 Responded to ping")
                     
             except asyncio.TimeoutError:
                 logger.warning("⏰ WebSocket receive timeout (60s) - connection may be dead")
                 # Check if we've received audio recently
-                idle_time = asyncio.get_event_loop().time() - last_audio_time
+                idle_time = loop.time() - last_audio_time
                 if idle_time > 120:  # 2 minutes idle
                     logger.warning("⚠️  Connection idle for 2 minutes, closing")
-                    await websocket.send_json({
+                    await _send_json(websocket, {
                         "type": "error",
                         "message": "Connection idle timeout"
                     })
@@ -869,7 +1180,7 @@ async def websocket_transcribe(websocket: WebSocket):
                 import traceback
                 logger.debug(traceback.format_exc())
                 try:
-                    await websocket.send_json({
+                    await _send_json(websocket, {
                         "type": "error",
                         "message": str(e)
                     })
@@ -882,7 +1193,7 @@ async def websocket_transcribe(websocket: WebSocket):
         import traceback
         logger.error(traceback.format_exc())
         try:
-            await websocket.send_json({
+            await _send_json(websocket, {
                 "type": "error",
                 "message": f"Transcription failed: {str(e)}"
             })
@@ -901,6 +1212,10 @@ async def websocket_transcribe(websocket: WebSocket):
             except asyncio.CancelledError:
                 pass
         
+        # Drop any interim transcript still waiting to be sent
+        if partial_flush_task:
+            partial_flush_task.cancel()
+        
         # Stop transcriber
         if transcriber:
             try:
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from functools import cached_property
 from typing import List, Union
 import json
 
@@ -15,9 +16,9 @@ class Settings(BaseSettings):
         "https://rag-demo-nine.vercel.app",  # Your actual Vercel app
     ]
     
-    @property
+    @cached_property
     def get_allowed_origins(self) -> List[str]:
-        """Parse ALLOWED_ORIGINS whether it's a list or JSON string"""
+        """Parse ALLOWED_ORIGINS whether it's a list or JSON string (parsed once, then cached)"""
         if isinstance(self.ALLOWED_ORIGINS, str):
             try:
                 return json.loads(self.ALLOWED_ORIGINS)
@@ -45,6 +46,7 @@ class Settings(BaseSettings):
     # Embeddings
     EMBEDDING_MODEL: str = "llama-text-embed-v2"
     EMBEDDING_DIMENSIONS: int = 1024
+    QUANTIZE_EMBEDDINGS: bool = False  # Keep chunk embeddings as int8 + scale until upsert
     
     # Vector Database (Pinecone)
     PINECONE_API_KEY: str = ""
@@ -56,6 +58,9 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Uploads
+    MAX_UPLOAD_SIZE_MB: int = 50  # Reject PDFs larger than this while streaming to disk
+
     # App Settings
     DEBUG: bool = True
     ENVIRONMENT: str = "development"
@@ -84,5 +84,4 @@ class ChatResponse(BaseModel):
     context: List[ContextChunk] = Field(..., description="Retrieved context chunks")
     session_id: str
     query: str
-    sources: Optional[List[SourceDocument]] = Field(default_factory=list, description="Source documents cited")
-
+    sources: List[SourceDocument] = Field(default_factory=list, description="Source documents cited")
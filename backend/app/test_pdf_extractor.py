@@ -7,6 +7,11 @@ from app.utils.pdf_extractor import PDFExtractor, extract_pdf
 import json
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson is optional for this script
+    orjson = None
+
 
 def test_pdf_extraction(pdf_path: str):
     """
@@ -99,8 +104,13 @@ def test_pdf_extraction(pdf_path: str):
         
         # Save results to JSON
         output_file = f"uploads/test_extraction_{doc_id}.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            Path(output_file).write_bytes(
+                orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            )
+        else:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
         print(f"\n💾 Full results saved to: {output_file}")
         
         print(f"\n{'=' * 80}")
@@ -3,14 +3,226 @@ BM25 Index for Keyword-Based Search (In-Memory)
 Free alternative to vector search - great for exact matches
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import functools
 import logging
-from rank_bm25 import BM25Okapi
+import multiprocessing
+import numpy as np
+import os
 import re
+import threading
+import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# A token is a run of word characters; equivalent to replacing punctuation
+# with spaces and splitting on whitespace, but done in a single scan
+_TOKEN_RE = re.compile(r"\w+")
+
+# Upper bound on chunks held across all session indexes; least recently
+# used sessions are evicted once a new build pushes the total past it
+MAX_INDEXED_CHUNKS = 200_000
+
+# Worker processes for BM25 builds (tokenizing + weighting is CPU-bound
+# Python, so concurrent uploads would otherwise serialize on the GIL)
+BM25_BUILD_PROCESSES = min(os.cpu_count() or 1, 4)
+
+
+@functools.lru_cache(maxsize=1024)
+def _tokenize_query(query: str) -> Tuple[str, ...]:
+    """
+    Cached query tokenizer (chat follow-ups repeat short queries a lot)
+    
+    Returns a tuple so cached results can't be mutated by callers; corpus
+    text goes through BM25Index._tokenize directly and is never cached.
+    """
+    return tuple(_TOKEN_RE.findall(query.lower()))
+
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Indices of the top_k highest scores, best first
+    
+    O(N) argpartition to find the K winners, then a stable sort of only
+    those K (ties keep corpus order, matching a full stable argsort)
+    """
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if top_k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, top_k)[:top_k]
+    candidates.sort()
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def _intern_corpus(
+    tokenized_corpus: List[List[str]]
+) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+    """
+    Intern tokens to int ids and pack the corpus into one contiguous buffer
+    
+    Args:
+        tokenized_corpus: Token list per document
+        
+    Returns:
+        Tuple of (vocab, token_ids, offsets); document i's token ids are
+        token_ids[offsets[i]:offsets[i + 1]] (int32 ids, int64 offsets)
+    """
+    vocab: Dict[str, int] = {}
+    doc_lengths = np.fromiter(
+        (len(tokens) for tokens in tokenized_corpus),
+        dtype=np.int64,
+        count=len(tokenized_corpus)
+    )
+    offsets = np.zeros(len(tokenized_corpus) + 1, dtype=np.int64)
+    np.cumsum(doc_lengths, out=offsets[1:])
+    token_ids = np.fromiter(
+        (vocab.setdefault(tok, len(vocab)) for tokens in tokenized_corpus for tok in tokens),
+        dtype=np.int32,
+        count=int(offsets[-1])
+    )
+    return vocab, token_ids, offsets
+
+
+class SparseBM25:
+    """
+    Okapi BM25 with term weights precomputed into a sparse term -> postings layout
+    
+    Same scoring as rank_bm25.BM25Okapi (k1, b, epsilon floor for negative idf),
+    but every (doc, term) weight is computed once at build time and stored in
+    CSC-style arrays, so scoring a query is a few vectorized adds per query
+    term instead of a Python loop over every document.
+    
+    This is the eager sparse scoring scheme the bm25s library uses, kept
+    in-house on plain numpy so there is no scipy/bm25s dependency to ship.
+    """
+    
+    def __init__(
+        self,
+        tokenized_corpus: List[List[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25
+    ):
+        self.corpus_size = len(tokenized_corpus)
+        self.vocab, token_ids, offsets = _intern_corpus(tokenized_corpus)
+        
+        doc_lengths = np.diff(offsets)
+        self.doc_lengths = doc_lengths.astype(np.int32)  # kept for stats/debugging
+        
+        # One (term, doc, tf) triple per distinct term in each document. Keys are
+        # term-major, so np.unique's sorted output is already grouped into
+        # per-term postings with docs in ascending order.
+        n_docs = max(self.corpus_size, 1)
+        doc_of_token = np.repeat(np.arange(self.corpus_size, dtype=np.int64), doc_lengths)
+        keys, term_freqs = np.unique(
+            token_ids.astype(np.int64) * n_docs + doc_of_token,
+            return_counts=True
+        )
+        cols = (keys // n_docs).astype(np.int32)
+        rows = (keys % n_docs).astype(np.int32)
+        tf = term_freqs.astype(np.float32)
+        doc_lengths = doc_lengths.astype(np.float32)
+        
+        self.avgdl = float(doc_lengths.mean()) if self.corpus_size else 0.0
+        
+        # idf with negative values floored to epsilon * mean idf (as BM25Okapi)
+        doc_freq = np.bincount(cols, minlength=len(self.vocab))
+        idf = np.log(self.corpus_size - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        if idf.size:
+            idf = np.where(idf < 0, epsilon * idf.mean(), idf)
+        
+        length_norm = k1 * (1 - b + b * doc_lengths / (self.avgdl or 1.0))
+        weights = idf[cols] * tf * (k1 + 1) / (tf + length_norm[rows])
+        
+        # Postings grouped by term: term t's docs live in indices[indptr[t]:indptr[t+1]]
+        self.indices = rows
+        self.data = weights.astype(np.float32)
+        self.indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=self.indptr[1:])
+    
+    def term_ids(self, query: Sequence[str]) -> np.ndarray:
+        """Map query tokens to vocab ids, dropping tokens not in the corpus"""
+        vocab_get = self.vocab.get
+        ids = np.fromiter((vocab_get(tok, -1) for tok in query), dtype=np.int64, count=len(query))
+        return ids[ids >= 0]
+    
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """
+        Score every document against the query tokens
+        
+        Repeated query tokens count once per occurrence, as in BM25Okapi.
+        
+        Args:
+            query: Tokenized query
+            
+        Returns:
+            Array of BM25 scores, one per document
+        """
+        scores = np.zeros(self.corpus_size, dtype=np.float32)
+        term_ids, counts = np.unique(self.term_ids(query), return_counts=True)
+        for term_id, count in zip(term_ids.tolist(), counts.tolist()):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # Each doc appears at most once per term, so a fancy-index add is safe
+            scores[self.indices[start:end]] += count * self.data[start:end]
+        return scores
+
+
+def _build_sparse_index(texts: List[str]) -> SparseBM25:
+    """
+    Tokenize chunk texts and build their SparseBM25
+    
+    Module-level so it can run in a worker process; only the texts go in
+    and only the (numpy-backed, picklable) index comes back.
+    """
+    tokenized_corpus = [BM25Index._tokenize(text) for text in texts]
+    
+    # Build BM25 index (term weights precomputed; corpus tokens not kept)
+    bm25 = SparseBM25(tokenized_corpus)
+    
+    # Log sample tokens for debugging (only formatted when DEBUG is on);
+    # token counts reuse the lengths computed once during the build
+    if tokenized_corpus and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📚 Sample tokens from first chunk: %s...", tokenized_corpus[0][:30])
+        logger.debug("📊 Token count per chunk: %s", bm25.doc_lengths.tolist())
+    
+    return bm25
+
+
+# Created on first use so importing this module (e.g. in every uvicorn
+# worker, or inside the pool's own spawned children, which re-import it)
+# never starts processes
+_build_pool: Optional[ProcessPoolExecutor] = None
+_build_pool_lock = threading.Lock()
+
+
+def _get_build_pool() -> ProcessPoolExecutor:
+    """Get or create the process pool used for BM25 builds"""
+    global _build_pool
+    with _build_pool_lock:
+        if _build_pool is None:
+            # "spawn" avoids forking a parent that already runs threads (and
+            # copying every in-memory index into each child)
+            _build_pool = ProcessPoolExecutor(
+                max_workers=BM25_BUILD_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _build_pool
+
+
+def _reset_build_pool():
+    """Discard a broken build pool so the next build creates a new one"""
+    global _build_pool
+    with _build_pool_lock:
+        if _build_pool is not None:
+            _build_pool.shutdown(wait=False, cancel_futures=True)
+            _build_pool = None
+
 
 class BM25Index:
     """
@@ -18,8 +230,11 @@ class BM25Index:
     Stored per session in RAM - no external services needed
     """
     
-    # Global storage: {session_id: {index, chunks, timestamp}}
-    _indexes = {}
+    # Global storage: {session_id: {index, chunks, timestamp}}, LRU order
+    # (oldest first), bounded by MAX_INDEXED_CHUNKS total chunks
+    _indexes: "OrderedDict[str, Dict]" = OrderedDict()
+    _total_chunks = 0
+    _lock = threading.RLock()
     
     @classmethod
     def build_index(
@@ -42,36 +257,75 @@ class BM25Index:
                 logger.warning(f"No chunks to index for session {session_id}")
                 return False
             
-            # Tokenize all chunk texts
-            tokenized_corpus = [
-                cls._tokenize(chunk.get('text', ''))
-                for chunk in chunks
-            ]
+            bm25 = _build_sparse_index([chunk.get('text', '') for chunk in chunks])
+            cls._store_index(session_id, chunks, bm25)
+            return True
             
-            # Log sample tokens for debugging
-            if tokenized_corpus:
-                logger.info(f"📚 Sample tokens from first chunk: {tokenized_corpus[0][:30]}...")
-                logger.info(f"📊 Token count per chunk: {[len(tokens) for tokens in tokenized_corpus]}")
+        except Exception as e:
+            logger.error(f"Error building BM25 index: {e}")
+            return False
+    
+    @classmethod
+    async def build_index_async(
+        cls,
+        session_id: str,
+        chunks: List[Dict]
+    ) -> bool:
+        """
+        Build BM25 index for a session in a worker process
+        
+        Only the chunk texts are sent to the worker and only the finished
+        SparseBM25 comes back; the chunk dicts never leave this process.
+        
+        Args:
+            session_id: Unique session/document ID
+            chunks: List of text chunks with metadata
             
-            # Build BM25 index
-            bm25 = BM25Okapi(tokenized_corpus)
+        Returns:
+            Success boolean
+        """
+        try:
+            if not chunks:
+                logger.warning(f"No chunks to index for session {session_id}")
+                return False
             
-            # Store in memory
-            cls._indexes[session_id] = {
-                'index': bm25,
-                'chunks': chunks,  # Keep reference to original chunks
-                'tokenized_corpus': tokenized_corpus,
-                'created_at': datetime.now(),
-                'num_chunks': len(chunks)
-            }
+            texts = [chunk.get('text', '') for chunk in chunks]
+            try:
+                future = _get_build_pool().submit(_build_sparse_index, texts)
+                bm25 = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                # A worker died; drop the pool so the next build gets a fresh one
+                logger.warning("BM25 build pool broke, rebuilding in-thread")
+                _reset_build_pool()
+                bm25 = await asyncio.to_thread(_build_sparse_index, texts)
             
-            logger.info(f"✓ Built BM25 index for session {session_id}: {len(chunks)} chunks")
+            cls._store_index(session_id, chunks, bm25)
             return True
             
         except Exception as e:
             logger.error(f"Error building BM25 index: {e}")
             return False
     
+    @classmethod
+    def _store_index(cls, session_id: str, chunks: List[Dict], bm25: "SparseBM25"):
+        """Register a built index for a session and evict LRU sessions if over budget"""
+        with cls._lock:
+            previous = cls._indexes.pop(session_id, None)
+            if previous is not None:
+                cls._total_chunks -= previous['num_chunks']
+            cls._indexes[session_id] = {
+                'index': bm25,
+                'chunks': chunks,  # Keep reference to original chunks
+                'created_at': datetime.now(),  # wall clock, display only
+                'created_monotonic': time.monotonic(),  # for age checks
+                'num_chunks': len(chunks),
+                'avgdl': bm25.avgdl
+            }
+            cls._total_chunks += len(chunks)
+            cls._evict_lru()
+        
+        logger.info(f"✓ Built BM25 index for session {session_id}: {len(chunks)} chunks")
+    
     @classmethod
     def search(
         cls,
@@ -90,128 +344,166 @@ class BM25Index:
         Returns:
             List of chunks with BM25 scores
         """
+        chunks, hits = cls.search_scores(session_id, query, top_k)
+        
+        # Build results with scores
+        results = []
+        for idx, score in hits:
+            # Include ALL results - BM25 can have negative scores for rare terms
+            # The ranking is still valid, just lower confidence
+            chunk = chunks[idx].copy()
+            chunk['bm25_score'] = score
+            chunk['search_method'] = 'bm25'
+            results.append(chunk)
+        
+        logger.info("BM25 search for '%s': %d results", query, len(results))
+        return results
+    
+    @classmethod
+    def search_scores(
+        cls,
+        session_id: str,
+        query: str,
+        top_k: int = 10
+    ) -> Tuple[List[Dict], List[Tuple[int, float]]]:
+        """
+        Search BM25 index and return ranked (chunk index, score) pairs
+        
+        Args:
+            session_id: Session to search in
+            query: Search query
+            top_k: Number of results to return
+            
+        Returns:
+            Tuple of (indexed chunks, [(idx, score), ...] best first); callers
+            look hits up in the returned chunks list instead of copying them
+        """
         try:
-            # Check if index exists
-            if session_id not in cls._indexes:
+            # Check if index exists (and mark it most recently used)
+            with cls._lock:
+                index_data = cls._indexes.get(session_id)
+                if index_data is not None:
+                    cls._indexes.move_to_end(session_id)
+            if index_data is None:
                 logger.warning(f"No BM25 index found for session '{session_id}'")
-                logger.info(f"Available sessions: {list(cls._indexes.keys())}")
-                return []
+                logger.info(f"Available sessions: {cls.get_all_sessions()}")
+                return [], []
             
-            index_data = cls._indexes[session_id]
             bm25 = index_data['index']
             chunks = index_data['chunks']
             
-            logger.debug(f"Searching BM25 index with {len(chunks)} chunks")
+            logger.debug("Searching BM25 index with %d chunks", len(chunks))
             
             # Tokenize query
-            tokenized_query = cls._tokenize(query)
+            tokenized_query = _tokenize_query(query)
             
             if not tokenized_query:
                 logger.warning(f"Query tokenized to empty: '{query}'")
-                return []
+                return chunks, []
             
-            logger.info(f"🔍 Tokenized query: {tokenized_query}")
+            logger.debug("🔍 Tokenized query: %s", tokenized_query)
             
             # Get BM25 scores
             scores = bm25.get_scores(tokenized_query)
             
-            # Log all scores for debugging
-            logger.info(f"📊 BM25 scores for {len(chunks)} chunks: {[round(s, 3) for s in scores]}")
-            
-            # Get top K indices
-            top_indices = sorted(
-                range(len(scores)),
-                key=lambda i: scores[i],
-                reverse=True
-            )[:top_k]
-            
-            # Build results with scores
-            results = []
-            for idx in top_indices:
-                # Include ALL results - BM25 can have negative scores for rare terms
-                # The ranking is still valid, just lower confidence
-                chunk = chunks[idx].copy()
-                chunk['bm25_score'] = float(scores[idx])
-                chunk['search_method'] = 'bm25'
-                results.append(chunk)
-                logger.info(f"  ✓ Chunk {idx}: score={scores[idx]:.3f}, preview={chunk.get('text', '')[:100]}...")
-            
-            if not results:
-                logger.warning(f"⚠️  No BM25 results found. Query tokens: {tokenized_query}")
+            # Log all scores for debugging (O(num_chunks) to format, so guarded)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📊 BM25 scores for %d chunks: %s", len(chunks), np.round(scores, 3).tolist())
+            
+            top_indices = _top_k_indices(scores, top_k)
+            hits = list(zip(top_indices.tolist(), scores[top_indices].tolist()))
+            
+            if not hits:
+                logger.warning("⚠️  No BM25 results found. Query tokens: %s", tokenized_query)
                 # Show sample of corpus tokens for debugging
-                if chunks:
+                if chunks and logger.isEnabledFor(logging.DEBUG):
                     sample_text = chunks[0].get('text', '')[:200]
                     sample_tokens = cls._tokenize(sample_text)[:20]
-                    logger.info(f"📝 Sample corpus tokens: {sample_tokens}")
+                    logger.debug("📝 Sample corpus tokens: %s", sample_tokens)
             
-            logger.info(f"BM25 search for '{query}': {len(results)} results")
-            return results
+            return chunks, hits
             
         except Exception as e:
             logger.error(f"Error searching BM25 index: {e}")
-            return []
+            return [], []
     
     @classmethod
     def get_index_stats(cls, session_id: str) -> Optional[Dict]:
         """Get statistics about an index"""
-        if session_id not in cls._indexes:
+        with cls._lock:
+            index_data = cls._indexes.get(session_id)
+        if index_data is None:
             return None
         
-        index_data = cls._indexes[session_id]
         return {
             'session_id': session_id,
             'num_chunks': index_data['num_chunks'],
+            'avgdl': index_data['avgdl'],
             'created_at': index_data['created_at'].isoformat(),
-            'age_seconds': (datetime.now() - index_data['created_at']).total_seconds()
+            'age_seconds': time.monotonic() - index_data['created_monotonic']
         }
     
     @classmethod
     def delete_index(cls, session_id: str) -> bool:
         """Delete index from memory"""
-        if session_id in cls._indexes:
-            del cls._indexes[session_id]
-            logger.info(f"Deleted BM25 index for session {session_id}")
-            return True
-        return False
+        with cls._lock:
+            index_data = cls._indexes.pop(session_id, None)
+            if index_data is None:
+                return False
+            cls._total_chunks -= index_data['num_chunks']
+        logger.info(f"Deleted BM25 index for session {session_id}")
+        return True
     
     @classmethod
     def get_all_sessions(cls) -> List[str]:
         """Get all active session IDs"""
-        return list(cls._indexes.keys())
+        with cls._lock:
+            return list(cls._indexes.keys())
     
     @classmethod
     def cleanup_old_indexes(cls, max_age_hours: int = 24):
-        """Remove indexes older than specified hours"""
-        now = datetime.now()
-        to_delete = []
-        
-        for session_id, data in cls._indexes.items():
-            age_hours = (now - data['created_at']).total_seconds() / 3600
-            if age_hours > max_age_hours:
-                to_delete.append(session_id)
+        """
+        Remove indexes older than specified hours
         
-        for session_id in to_delete:
-            cls.delete_index(session_id)
+        Memory is bounded by the LRU eviction in build_index; this is only
+        an optional age sweep. Ages use the monotonic clock, so wall-clock
+        jumps (NTP, DST) can't expire or pin indexes.
+        """
+        cutoff = time.monotonic() - max_age_hours * 3600
+        with cls._lock:
+            to_delete = [
+                session_id for session_id, data in cls._indexes.items()
+                if data['created_monotonic'] < cutoff
+            ]
+            for session_id in to_delete:
+                cls.delete_index(session_id)
         
         if to_delete:
             logger.info(f"Cleaned up {len(to_delete)} old BM25 indexes")
     
+    @classmethod
+    def _evict_lru(cls):
+        """
+        Drop least recently used indexes until under MAX_INDEXED_CHUNKS
+        (caller holds _lock; the newest index is never evicted)
+        """
+        evicted = 0
+        while cls._total_chunks > MAX_INDEXED_CHUNKS and len(cls._indexes) > 1:
+            _, index_data = cls._indexes.popitem(last=False)
+            cls._total_chunks -= index_data['num_chunks']
+            evicted += 1
+        
+        if evicted:
+            logger.info(f"Evicted {evicted} least recently used BM25 indexes ({cls._total_chunks} chunks held)")
+    
     @staticmethod
     def _tokenize(text: str) -> List[str]:
         """
         Simple tokenization for BM25
-        Lowercases, removes punctuation, splits on whitespace
+        Lowercases and returns runs of word characters (punctuation and
+        whitespace both separate tokens)
         """
-        # Lowercase
-        text = text.lower()
-        
-        # Remove punctuation but keep alphanumeric
-        text = re.sub(r'[^\w\s]', ' ', text)
-        
-        # Split and filter empty
-        tokens = [token for token in text.split() if token]
-        
-        return tokens
+        return _TOKEN_RE.findall(text.lower())
 
 
 def build_bm25_index(session_id: str, chunks: List[Dict]) -> bool:
@@ -228,6 +520,20 @@ def build_bm25_index(session_id: str, chunks: List[Dict]) -> bool:
     return BM25Index.build_index(session_id, chunks)
 
 
+async def build_bm25_index_async(session_id: str, chunks: List[Dict]) -> bool:
+    """
+    Convenience function to build BM25 index in a worker process
+    
+    Args:
+        session_id: Unique session identifier
+        chunks: List of text chunks
+        
+    Returns:
+        Success boolean
+    """
+    return await BM25Index.build_index_async(session_id, chunks)
+
+
 def search_bm25(session_id: str, query: str, top_k: int = 10) -> List[Dict]:
     """
     Convenience function to search BM25 index
@@ -243,6 +549,25 @@ def search_bm25(session_id: str, query: str, top_k: int = 10) -> List[Dict]:
     return BM25Index.search(session_id, query, top_k)
 
 
+def search_bm25_scores(
+    session_id: str,
+    query: str,
+    top_k: int = 10
+) -> Tuple[List[Dict], List[Tuple[int, float]]]:
+    """
+    Convenience function to search BM25 index without copying chunks
+    
+    Args:
+        session_id: Session identifier
+        query: Search query
+        top_k: Number of results
+        
+    Returns:
+        Tuple of (indexed chunks, [(idx, score), ...] best first)
+    """
+    return BM25Index.search_scores(session_id, query, top_k)
+
+
 def get_bm25_stats(session_id: str) -> Optional[Dict]:
     """Get BM25 index statistics"""
     return BM25Index.get_index_stats(session_id)
@@ -5,8 +5,9 @@ Manages conversation history for RAG chatbot
 
 from supabase import create_client, Client
 from app.core.config import settings
+import asyncio
 import logging
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,12 @@ class ChatStorage:
     Store and retrieve chat history from Supabase
     """
     
+    REQUIRED_MESSAGE_FIELDS = ("session_id", "role", "message")
+    
+    # Columns returned by history reads; metadata (JSONB with sources) is opt-in
+    HISTORY_COLUMNS = "id, role, message, created_at"
+    CONTEXT_COLUMNS = "role, message, created_at"
+    
     def __init__(self):
         """Initialize Supabase client"""
         self.client: Client = create_client(
@@ -24,6 +31,7 @@ class ChatStorage:
             settings.SUPABASE_SERVICE_KEY
         )
         self.table_name = "chat_history"
+        self._background_tasks = set()
         self._ensure_table_exists()
     
     def _ensure_table_exists(self):
@@ -40,7 +48,8 @@ class ChatStorage:
             created_at TIMESTAMPTZ DEFAULT NOW()
         );
         
-        CREATE INDEX idx_chat_history_session ON chat_history(session_id, created_at);
+        -- Same index as migrations/002_chat_history_keyset_index.sql; matches the newest-first reads below
+        CREATE INDEX idx_chat_history_session ON chat_history(session_id, created_at DESC, id DESC);
         """
         logger.info(f"Using chat history table: {self.table_name}")
     
@@ -63,27 +72,81 @@ class ChatStorage:
         Returns:
             Saved message record
         """
+        saved = self.save_messages([{
+            "session_id": session_id,
+            "role": role,
+            "message": message,
+            "metadata": metadata
+        }])
+        return saved[0] if saved else {}
+    
+    def save_messages(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Save several chat messages to Supabase in a single insert
+        
+        Args:
+            messages: List of dicts with 'session_id', 'role', 'message' and
+                optional 'metadata' keys (same fields as save_message)
+        
+        Returns:
+            Saved message records
+        """
         try:
-            data = {
-                "session_id": session_id,
-                "role": role,
-                "message": message,
-                "metadata": metadata or {}
-            }
+            if not messages:
+                return []
+            
+            for msg in messages:
+                missing = [key for key in self.REQUIRED_MESSAGE_FIELDS if not msg.get(key)]
+                if missing:
+                    raise ValueError(f"Chat message missing required fields: {', '.join(missing)}")
+            
+            data = [
+                {
+                    "session_id": msg["session_id"],
+                    "role": msg["role"],
+                    "message": msg["message"],
+                    "metadata": msg.get("metadata") or {}
+                }
+                for msg in messages
+            ]
             
             result = self.client.table(self.table_name).insert(data).execute()
             
-            logger.info(f"✓ Saved {role} message for session {session_id}")
-            return result.data[0] if result.data else {}
+            logger.info(f"✓ Saved {len(data)} messages for session {data[0]['session_id']}")
+            return result.data or []
             
         except Exception as e:
-            logger.error(f"Error saving message: {e}")
+            logger.error(f"Error saving messages: {e}")
             raise
     
+    async def save_messages_async(self, messages: List[Dict]) -> List[Dict]:
+        """Save messages in one insert without blocking the event loop"""
+        return await asyncio.to_thread(self.save_messages, messages)
+    
+    def save_messages_background(self, messages: List[Dict]) -> asyncio.Task:
+        """
+        Fire-and-forget save_messages_async (must be called from a running loop)
+        
+        Failures are logged instead of raised, so the caller can finish its
+        response without waiting for the Supabase round trip.
+        """
+        task = asyncio.create_task(self.save_messages_async(messages))
+        # Keep a strong reference until the task finishes
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_save_done)
+        return task
+    
+    def _on_background_save_done(self, task: asyncio.Task):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background message save failed: {task.exception()}")
+    
     def get_chat_history(
         self,
         session_id: str,
-        limit: int = 10
+        limit: int = 10,
+        include_metadata: bool = False,
+        before: Optional[Dict[str, Any]] = None
     ) -> List[Dict]:
         """
         Get chat history for a session
@@ -91,25 +154,84 @@ class ChatStorage:
         Args:
             session_id: Session identifier
             limit: Maximum number of messages to retrieve (default: 10 most recent)
+            include_metadata: Also fetch the metadata column (sources, chunks);
+                pass True only when the caller needs them
+            before: Only return messages older than this cursor
+                (next_cursor from get_chat_history_page)
         
         Returns:
             List of messages ordered by timestamp (oldest first)
         """
+        return self.get_chat_history_page(
+            session_id,
+            limit=limit,
+            include_metadata=include_metadata,
+            before=before
+        )['messages']
+    
+    def get_chat_history_page(
+        self,
+        session_id: str,
+        limit: int = 10,
+        include_metadata: bool = False,
+        before: Optional[Dict[str, Any]] = None
+    ) -> Dict:
+        """
+        Get one page of chat history using keyset pagination
+        
+        Pages walk backwards in time: pass the returned next_cursor as
+        before to get the previous page. Uses (created_at, id) < cursor
+        instead of OFFSET, so each page is an index range scan however long
+        the session; id breaks ties between messages saved in one insert.
+        
+        Args:
+            session_id: Session identifier
+            limit: Maximum number of messages in the page
+            include_metadata: Also fetch the metadata column
+            before: Only return messages older than this cursor
+                ({'created_at': ..., 'id': ...})
+        
+        Returns:
+            Dict with 'messages' (oldest first) and 'next_cursor' (created_at
+            and id of the oldest message, or None when there are no older messages)
+        """
         try:
-            result = self.client.table(self.table_name).select("*").eq(
+            columns = self.HISTORY_COLUMNS + (", metadata" if include_metadata else "")
+            
+            query = self.client.table(self.table_name).select(columns).eq(
                 "session_id", session_id
+            )
+            if before:
+                created_at, msg_id = before['created_at'], int(before['id'])
+                query = query.or_(
+                    f'created_at.lt."{created_at}",'
+                    f'and(created_at.eq."{created_at}",id.lt.{msg_id})'
+                )
+            
+            # id breaks created_at ties: messages saved in one insert share a
+            # timestamp, and BIGSERIAL ids keep their insert order
+            result = query.order(
+                "created_at", desc=True
             ).order(
-                "created_at", desc=False
+                "id", desc=True
             ).limit(limit).execute()
             
             messages = result.data if result.data else []
+            
+            # Reverse to get chronological order
+            messages.reverse()
+            
             logger.info(f"Retrieved {len(messages)} messages for session {session_id}")
             
-            return messages
+            next_cursor = (
+                {'created_at': messages[0]['created_at'], 'id': messages[0]['id']}
+                if len(messages) == limit else None
+            )
+            return {'messages': messages, 'next_cursor': next_cursor}
             
         except Exception as e:
             logger.error(f"Error getting chat history: {e}")
-            return []
+            return {'messages': [], 'next_cursor': None}
     
     def get_recent_context(
         self,
@@ -131,11 +253,13 @@ class ChatStorage:
             limit = num_turns * 2
             
             result = self.client.table(self.table_name).select(
-                "role, message, created_at"
+                self.CONTEXT_COLUMNS
             ).eq(
                 "session_id", session_id
             ).order(
                 "created_at", desc=True
+            ).order(
+                "id", desc=True  # Keeps a turn's question before its answer
             ).limit(limit).execute()
             
             messages = result.data if result.data else []
@@ -151,6 +275,14 @@ class ChatStorage:
             logger.error(f"Error getting recent context: {e}")
             return []
     
+    async def get_chat_history_async(self, session_id: str, **kwargs) -> List[Dict]:
+        """get_chat_history without blocking the event loop"""
+        return await asyncio.to_thread(self.get_chat_history, session_id, **kwargs)
+    
+    async def get_recent_context_async(self, session_id: str, num_turns: int = 5) -> List[Dict]:
+        """get_recent_context without blocking the event loop"""
+        return await asyncio.to_thread(self.get_recent_context, session_id, num_turns)
+    
     def clear_session(self, session_id: str) -> int:
         """
         Clear all messages for a session
@@ -176,5 +308,19 @@ class ChatStorage:
             return 0
 
 
-# Singleton instance
-chat_storage = ChatStorage()
+# Singleton instance (created on first use, not at import time)
+_chat_storage = None
+
+def get_chat_storage() -> ChatStorage:
+    """Get or create chat storage singleton"""
+    global _chat_storage
+    if _chat_storage is None:
+        _chat_storage = ChatStorage()
+    return _chat_storage
+
+
+def __getattr__(name: str):
+    """Keep `from app.utils.chat_storage import chat_storage` working lazily"""
+    if name == "chat_storage":
+        return get_chat_storage()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
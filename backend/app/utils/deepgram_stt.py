@@ -11,8 +11,10 @@ from deepgram import (
 )
 from app.core.config import settings
 import logging
-from typing import Callable, Optional
+from typing import Callable, List, Optional
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,10 @@ class DeepgramTranscriber:
     Handles real-time speech-to-text with Deepgram
     """
     
+    # Audio frames buffered ahead of the sender (~1s of 20ms frames); when
+    # the uplink stalls the oldest frames are dropped to keep latency bounded
+    AUDIO_QUEUE_SIZE = 50
+    
     def __init__(self, api_key: Optional[str] = None):
         """Initialize Deepgram client"""
         self.api_key = api_key or settings.DEEPGRAM_API_KEY
@@ -36,6 +42,23 @@ class DeepgramTranscriber:
         self.dg_connection = None
         self.is_connected = False
         self.loop = None  # Store event loop reference
+        self._loop_thread_id: Optional[int] = None
+        
+        # SDK send() frames and writes the socket synchronously; run it on
+        # one dedicated thread (single worker keeps audio chunks in order)
+        self._send_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dg-send")
+        self._audio_queue: Optional[asyncio.Queue] = None
+        self._send_task: Optional[asyncio.Task] = None
+        
+        # SDK callbacks run on Deepgram's network thread; they only enqueue
+        # events here and a single task on self.loop drains them in order
+        self._events: Optional[asyncio.Queue] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        
+        # LocalAgreement-2 state for interim results: words of the previous
+        # hypothesis and how many leading words have already been emitted
+        self._prev_interim: List[str] = []
+        self._confirmed_words = 0
         
         logger.info("Deepgram transcriber initialized")
     
@@ -52,7 +75,16 @@ class DeepgramTranscriber:
         """
         try:
             # Store the current event loop
-            self.loop = asyncio.get_event_loop()
+            self.loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            
+            # One queue + drain task per connection instead of a Future per event
+            self._events = asyncio.Queue()
+            self._drain_task = asyncio.create_task(self._drain_events(on_transcript, on_error))
+            
+            # Bounded buffer between the websocket receiver and the SDK send
+            self._audio_queue = asyncio.Queue(maxsize=self.AUDIO_QUEUE_SIZE)
+            self._send_task = asyncio.create_task(self._send_loop())
             
             # Get live transcription connection
             self.dg_connection = self.deepgram.listen.live.v("1")
@@ -64,22 +96,29 @@ class DeepgramTranscriber:
                 
             def on_message(self_inner, result, **kwargs):
                 try:
-                    sentence = result.channel.alternatives[0].transcript
-                    
-                    if len(sentence) == 0:
+                    # Silence/keepalive results carry no alternatives or an empty transcript
+                    alternatives = result.channel.alternatives
+                    if not alternatives:
+                        return
+                    sentence = alternatives[0].transcript
+                    if not sentence:
                         return
                     
                     is_final = result.is_final
                     
-                    logger.info(f"Transcript ({'final' if is_final else 'interim'}): {sentence}")
-                    
-                    # Schedule async callback in the stored event loop
-                    if self.loop and self.loop.is_running():
-                        asyncio.run_coroutine_threadsafe(
-                            on_transcript(sentence, is_final),
-                            self.loop
-                        )
+                    if is_final:
+                        self._reset_interim()
                     else:
+                        # Only pass on interims whose agreed prefix grew
+                        sentence = self._stable_interim(sentence)
+                        if sentence is None:
+                            return
+                    
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(f"Transcript ({'final' if is_final else 'interim'}): {sentence}")
+                    
+                    # Hand the transcript to the drain task on the stored event loop
+                    if not self._post_event(('transcript', sentence, is_final)):
                         logger.error("Event loop not available")
                         
                 except Exception as e:
@@ -101,11 +140,7 @@ class DeepgramTranscriber:
             def on_error_event(self_inner, error, **kwargs):
                 error_msg = f"Deepgram error: {error}"
                 logger.error(error_msg)
-                if on_error and self.loop and self.loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        on_error(error_msg),
-                        self.loop
-                    )
+                self._post_event(('error', error_msg))
             
             def on_unhandled(self_inner, unhandled, **kwargs):
                 logger.debug(f"Unhandled event: {unhandled}")
@@ -150,15 +185,130 @@ class DeepgramTranscriber:
             logger.error(f"❌ Error starting transcription: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            await self._stop_sender()
+            await self._stop_drain()
             if on_error:
-                asyncio.run_coroutine_threadsafe(on_error(str(e)), self.loop)
+                await on_error(str(e))
+            return False
+    
+    def _stable_interim(self, sentence: str) -> Optional[str]:
+        """
+        LocalAgreement-2 over interim hypotheses
+        
+        A word counts as confirmed once two consecutive hypotheses agree on
+        it (longest common word prefix). Returns the confirmed text when it
+        grew since the last emit, else None so the callback is skipped.
+        """
+        words = sentence.split()
+        prev = self._prev_interim
+        agreed = 0
+        for a, b in zip(words, prev):
+            if a != b:
+                break
+            agreed += 1
+        self._prev_interim = words
+        
+        if agreed <= self._confirmed_words:
+            return None
+        self._confirmed_words = agreed
+        return " ".join(words[:agreed])
+    
+    def _reset_interim(self):
+        """Forget interim state once a final result closes the segment"""
+        self._prev_interim = []
+        self._confirmed_words = 0
+    
+    def _post_event(self, event: Optional[tuple]) -> bool:
+        """
+        Queue an event for the drain task (safe to call from any thread)
+        
+        Returns:
+            False if there is no running loop to deliver it to
+        """
+        if not (self.loop and self.loop.is_running() and self._events is not None):
             return False
+        if threading.get_ident() == self._loop_thread_id:
+            # Already on the loop thread: no need to wake it via the self-pipe
+            self._events.put_nowait(event)
+        else:
+            self.loop.call_soon_threadsafe(self._events.put_nowait, event)
+        return True
+    
+    async def _drain_events(self, on_transcript: Callable, on_error: Optional[Callable]):
+        """Deliver queued transcript/error events to the callbacks in order until stopped"""
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            try:
+                if event[0] == 'transcript':
+                    await on_transcript(event[1], event[2])
+                elif on_error:
+                    await on_error(event[1])
+            except Exception as e:
+                logger.error(f"Error in transcript callback: {e}")
+    
+    async def _stop_drain(self):
+        """Stop the drain task after it delivers everything already queued"""
+        if self._drain_task is None:
+            return
+        self._events.put_nowait(None)
+        try:
+            await asyncio.wait_for(self._drain_task, timeout=5)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._drain_task.cancel()
+        self._drain_task = None
+        self._events = None
+    
+    def enqueue_audio(self, audio_data: bytes):
+        """
+        Queue audio for the sender task without waiting on the network
+        
+        If the buffer is full (uplink stalled) the oldest frame is dropped,
+        so memory and added latency stay bounded.
+        """
+        if self._audio_queue is None:
+            logger.warning("No active Deepgram connection")
+            return
+        self._put_dropping_oldest(audio_data)
+    
+    def _put_dropping_oldest(self, item: Optional[bytes]):
+        """put_nowait on the audio queue, evicting the oldest frame when full"""
+        try:
+            self._audio_queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._audio_queue.get_nowait()
+            self._audio_queue.put_nowait(item)
+            logger.debug("Audio buffer full, dropped oldest frame")
+    
+    async def _send_loop(self):
+        """Forward queued audio frames to Deepgram in order until stopped"""
+        while True:
+            audio_data = await self._audio_queue.get()
+            if audio_data is None:
+                return
+            await self.send_audio(audio_data)
+    
+    async def _stop_sender(self):
+        """Stop the sender task after it forwards the frames already queued"""
+        if self._send_task is None:
+            return
+        self._put_dropping_oldest(None)
+        try:
+            await asyncio.wait_for(self._send_task, timeout=5)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._send_task.cancel()
+        self._send_task = None
+        self._audio_queue = None
     
     async def send_audio(self, audio_data: bytes):
-        """Send audio data to Deepgram"""
+        """Send audio data to Deepgram (directly; streaming callers use enqueue_audio)"""
         try:
-            if self.dg_connection and self.is_connected:
-                self.dg_connection.send(audio_data)
+            connection = self.dg_connection
+            if connection and self.is_connected:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._send_executor, connection.send, audio_data
+                )
             else:
                 logger.warning("No active Deepgram connection")
         except Exception as e:
@@ -167,11 +317,17 @@ class DeepgramTranscriber:
     async def stop_transcription(self):
         """Stop transcription and close connection"""
         try:
+            await self._stop_sender()
             if self.dg_connection:
-                self.dg_connection.finish()
-                self.dg_connection = None
+                # Queued behind any pending sends, so buffered audio goes out first
+                connection, self.dg_connection = self.dg_connection, None
+                await asyncio.get_running_loop().run_in_executor(
+                    self._send_executor, connection.finish
+                )
                 self.is_connected = False
                 logger.info("✓ Deepgram transcription stopped")
+            await self._stop_drain()
+            self._send_executor.shutdown(wait=False)
         except Exception as e:
             logger.error(f"Error stopping transcription: {e}")
     
@@ -5,19 +5,310 @@ Also handles RAG chat with context and history
 """
 
 import google.generativeai as genai
+from PIL import Image
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+import functools
+import hashlib
+import io
+import json
 import logging
-from PIL import Image
+import mimetypes
+import re
+import asyncio
+import threading
+import time
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a chars-per-token estimate
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
+# Answer given without calling Gemini when retrieval found nothing
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the uploaded documents for this session. Please make sure you've uploaded documents first."
+
+# Fixed RAG chat system instruction, set once on the chat model (not resent
+# inside every prompt) so it forms a stable, cacheable prefix
+RAG_SYSTEM_INSTRUCTION = """You are a helpful AI assistant that answers questions based on the provided document context.
+
+IMPORTANT INSTRUCTIONS:
+- Provide complete, focused answers in a natural, conversational style
+- Be concise: aim for at most 350 words unless the user asks for more detail
+- Skip preamble and recaps; get straight to the answer
+- Use **markdown formatting** sparingly and strategically:
+  * Use **bold** ONLY for 2-3 most important terms or section titles
+  * Use bullet points (- or numbers) for lists
+  * Use ## for main section headings (use sparingly, 1-2 max)
+- Write in short, clear paragraphs (2-4 paragraphs for complex questions)
+- Answer based ONLY on the information in the provided document context
+
+CRITICAL - CITATION RULES:
+- When referencing information, cite the source number [1], [2], [3] etc.
+- Each source number corresponds to a PAGE in the document (not individual chunks)
+- Place citations strategically - NOT after every sentence
+- Cite once per paragraph or when introducing new information from a specific page
+- Multiple facts from the same page can share one citation at the end
+- DO NOT over-cite - keep it clean and readable
+
+CITATION EXAMPLES:
+
+✅ CORRECT (minimal citations):
+Sanket Rajendra Shinde is a Software Development Engineer seeking opportunities. He has experience at Neurolaw AI where he developed custom RAG pipelines, integrated Cloud OCR, and built real-time court scrapers [1]. 
+
+His technical skills include Full Stack development, Cloud technologies, and AI/ML & GenAI [1]. He has several projects including Quickmed and InterviewAce [1].
+
+❌ WRONG (too many citations):
+Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1]. He has skills [1].
+"""
+
+# Image analysis prompt, with a slot for (truncated) page text when there is any
+ANALYSIS_PROMPT = """Analyze this image in detail. Provide:
+1. What type of visual is this? (chart, diagram, graph, table, photo, illustration, etc.)
+2. What is the main subject or purpose?
+3. Key information or data shown
+4. Any text visible in the image
+5. How this relates to the document context
+
+Be concise but thorough."""
+ANALYSIS_PROMPT_WITH_CONTEXT = ANALYSIS_PROMPT.replace("{", "{{").replace("}", "}}") + "\n\nDocument context: {context}"
+
+
+@functools.lru_cache(maxsize=64)
+def _analysis_prompt(context_preview: str) -> str:
+    """Analysis prompt for a page's (truncated) text; cached since every image on the page shares it"""
+    if context_preview:
+        return ANALYSIS_PROMPT_WITH_CONTEXT.format_map({'context': context_preview})
+    return ANALYSIS_PROMPT
+
+
+# Sentence boundary: whitespace after terminal punctuation
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Inline source citation in an answer: [1], [2], ...
+_CITATION_RE = re.compile(r"\[(\d+)\]")
+
+
+def compress_page_text(texts: List[str]) -> str:
+    """
+    Merge one page's chunk texts into compact prompt text
+    
+    Adjacent chunks overlap by a couple of sentences (see SemanticChunker),
+    so sentences already seen on the page are dropped, and runs of
+    whitespace (PDF line breaks, padding) collapse to single spaces.
+    Meaning is unchanged; only repeated text and layout noise go.
+    
+    Args:
+        texts: Chunk texts from the same page, in retrieval order
+        
+    Returns:
+        One line per chunk, each with its not-yet-seen sentences
+    """
+    seen = set()
+    lines = []
+    for text in texts:
+        sentences = []
+        for sentence in _SENTENCE_SPLIT_RE.split(text):
+            sentence = " ".join(sentence.split())
+            if sentence and sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+        if sentences:
+            lines.append(" ".join(sentences))
+    return "\n".join(lines)
+
+
+def clip_message(message: str, max_chars: int) -> str:
+    """
+    Shorten an older chat message for history replay
+    
+    Keeps whole leading sentences up to max_chars (or a hard cut if the
+    first sentence alone is longer) and marks the message as clipped.
+    
+    Args:
+        message: Message text
+        max_chars: Character budget for the clipped message
+        
+    Returns:
+        The message unchanged if it fits, else its clipped form ending in "…"
+    """
+    message = " ".join(str(message).split())
+    if len(message) <= max_chars:
+        return message
+    
+    clipped = ""
+    for sentence in _SENTENCE_SPLIT_RE.split(message):
+        if len(clipped) + len(sentence) + 1 > max_chars:
+            break
+        clipped = f"{clipped} {sentence}" if clipped else sentence
+    return f"{clipped or message[:max_chars]} …"
+
+
+# Rough chars per token when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer once; cl100k_base approximates Gemini's token counts"""
+    return tiktoken.get_encoding("cl100k_base") if tiktoken else None
+
+
+# genai.configure sets module-global auth state; only touch it under this lock
+_configure_lock = threading.Lock()
+_configured_key: Optional[str] = None
+
+
+@functools.lru_cache(maxsize=4)
+def get_generative_model(
+    api_key: str,
+    model_name: str = 'gemini-2.0-flash-exp',
+    system_instruction: Optional[str] = None
+) -> genai.GenerativeModel:
+    """
+    Shared GenerativeModel per (api key, model, system instruction),
+    configuring genai only when the key changes
+    
+    Args:
+        api_key: Google API key
+        model_name: Gemini model name
+        system_instruction: Optional fixed system instruction for the model
+        
+    Returns:
+        Cached GenerativeModel (safe to share across threads)
+    """
+    global _configured_key
+    with _configure_lock:
+        if _configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+        return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def _add_source(sources: Dict[str, Dict], chunk: Dict) -> None:
+    """Fold one chunk into a pdf_url -> source map (pages deduped in a set)"""
+    pdf_url = chunk.get('pdf_url')
+    if not pdf_url:
+        return
+    
+    source = sources.get(pdf_url)
+    if source is None:
+        # First chunk seen for a document decides its filename
+        source = sources[pdf_url] = {
+            'url': pdf_url,
+            'filename': chunk.get('filename'),
+            'pages': set()
+        }
+    
+    page = chunk.get('page_num')
+    if page:
+        source['pages'].add(page)
+
+
+def _sorted_sources(sources: Dict[str, Dict]) -> List[Dict]:
+    """Source list from an _add_source map, pages sorted"""
+    return [{**source, 'pages': sorted(source['pages'])} for source in sources.values()]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate prompt token count for a piece of text
+    
+    Args:
+        text: Text to measure
+        
+    Returns:
+        Token count (tiktoken cl100k_base, or a character estimate)
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# Token budget for the page text shown alongside an image (~500 characters)
+ANALYSIS_CONTEXT_TOKENS = 120
+
+
+@functools.lru_cache(maxsize=64)
+def context_preview(text: str, max_tokens: int = ANALYSIS_CONTEXT_TOKENS) -> str:
+    """
+    Leading whole sentences of a page's text within a token budget
+    
+    Cached since every image (batch) on a page asks for the same preview.
+    
+    Args:
+        text: Page text
+        max_tokens: Token budget for the preview
+        
+    Returns:
+        Whitespace-normalized preview; a cut at a word boundary if the
+        first sentence alone is over budget
+    """
+    text = " ".join(text.split())
+    sentences = []
+    used = 0
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        used += count_tokens(sentence)
+        if used > max_tokens:
+            break
+        sentences.append(sentence)
+    
+    if sentences:
+        return " ".join(sentences)
+    # First sentence is too long on its own: cut by the chars-per-token estimate
+    return text[:max_tokens * CHARS_PER_TOKEN].rsplit(" ", 1)[0]
+
 
 class GeminiVisionAnalyzer:
     """
     Use Gemini 2.5 Flash to analyze images extracted from PDFs
     """
     
+    # Chat model tiers: simple lookups go to the cheaper, faster lite model
+    CHAT_MODEL = 'gemini-2.0-flash-exp'
+    CHAT_LITE_MODEL = 'gemini-2.0-flash-lite'
+    # Queries scoring below this (query words + 2 per chunk + 1 per history
+    # message) are answered by CHAT_LITE_MODEL
+    LITE_COMPLEXITY_THRESHOLD = 20
+    
+    # Generation settings for RAG chat answers
+    CHAT_GENERATION_CONFIG = {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 40,
+        # No max_output_tokens: answer length is steered by the prompt instead
+    }
+    
+    # Bounds for the Gemini/local token count ratio used to scale the context budget
+    TOKEN_SCALE_BOUNDS = (0.5, 2.0)
+    # Seconds before a failed calibration is attempted again
+    TOKEN_SCALE_RETRY_SECONDS = 300
+    
+    # Context stops at the first page scoring below this fraction of the best page
+    CONTEXT_RELEVANCE_CUTOFF = 0.5
+    
+    # Built context strings kept for follow-up questions over the same chunks
+    CONTEXT_CACHE_SIZE = 256
+    
+    # Generated answers reused for a repeated question over the same chunks
+    # and recent history (in-process; entries expire after ANSWER_CACHE_TTL)
+    ANSWER_CACHE_SIZE = 512
+    ANSWER_CACHE_TTL = 6 * 3600  # seconds
+    
+    # Max images sent together in one multi-image analysis request
+    IMAGE_BATCH_SIZE = 8
+    
+    # Prefix per history role (anything that isn't 'user' is the assistant)
+    HISTORY_ROLE_PREFIX = {'user': 'User: '}
+    
+    # History replay: the most recent messages verbatim, older ones (up to
+    # 10 in total) clipped so the history segment stays a bounded size
+    HISTORY_RAW_MESSAGES = 4
+    HISTORY_CLIP_CHARS = 300
+    
     def __init__(self, api_key: str):
         """
         Initialize Gemini Vision Analyzer
@@ -25,9 +316,21 @@ class GeminiVisionAnalyzer:
         Args:
             api_key: Google API key for Gemini
         """
-        genai.configure(api_key=api_key)
-        # Use Gemini 2.5 Flash as specified
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Use Gemini 2.5 Flash as specified (model shared across analyzers)
+        self.model = get_generative_model(api_key, 'gemini-2.0-flash-exp')
+        # Chat models carry the RAG system instruction; prompts hold only the per-turn parts
+        self.chat_model = get_generative_model(api_key, self.CHAT_MODEL, RAG_SYSTEM_INSTRUCTION)
+        self.chat_lite_model = get_generative_model(api_key, self.CHAT_LITE_MODEL, RAG_SYSTEM_INSTRUCTION)
+        self._context_cache: "OrderedDict[bytes, Tuple[str, List[Dict]]]" = OrderedDict()
+        self._context_cache_lock = threading.Lock()
+        self._answer_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._answer_cache_lock = threading.Lock()
+        self._answer_cache_hits = 0
+        self._answer_cache_misses = 0
+        self._token_scale: Optional[float] = None
+        self._token_scale_retry_at = 0.0
+        self._token_scale_lock = threading.Lock()
+        self._start_token_scale_calibration()
         logger.info("Gemini 2.5 Flash Vision Analyzer initialized")
     
     def chat_with_context(
@@ -35,7 +338,7 @@ class GeminiVisionAnalyzer:
         query: str,
         context_chunks: List[Dict],
         chat_history: Optional[List[Dict]] = None,
-        max_context_length: int = 8000
+        max_context_tokens: int = 4000
     ) -> Dict[str, any]:
         """
         Generate chat response with RAG context and conversation history
@@ -44,164 +347,477 @@ class GeminiVisionAnalyzer:
             query: User's question
             context_chunks: Retrieved chunks from Pinecone
             chat_history: Previous conversation messages [{'role': 'user'|'assistant', 'message': '...'}]
-            max_context_length: Maximum context length in characters
+            max_context_tokens: Token budget for the document context
             
         Returns:
             Response dictionary with answer, sources, and metadata
         """
+        if not context_chunks:
+            # Nothing to ground an answer in; skip the Gemini round-trip
+            return self._no_context_response()
+        
+        cache_key = self._answer_key(query, context_chunks, chat_history, max_context_tokens)
+        cached = self._get_cached_answer(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Build context from chunks
-            context_text = self._build_context(context_chunks, max_context_length)
+            prompt, sources = self._build_chat_prompt(query, context_chunks, chat_history, max_context_tokens)
+            model, model_name = self._route_chat_model(query, context_chunks, chat_history)
             
-            # Build conversation history
-            history_text = self._build_history(chat_history) if chat_history else ""
+            # Generate response
+            response = model.generate_content(
+                prompt,
+                generation_config=self.CHAT_GENERATION_CONFIG
+            )
             
-            # Create RAG prompt
-            prompt = self._create_rag_prompt(query, context_text, history_text)
+            return self._cache_answer(
+                cache_key, self.finalize_answer(response.text, context_chunks, sources, model_name)
+            )
             
-            logger.info(f"Generating response for query: {query[:100]}...")
-            logger.info(f"  Context chunks: {len(context_chunks)}")
-            logger.info(f"  History messages: {len(chat_history) if chat_history else 0}")
+        except Exception as e:
+            logger.error(f"Error generating chat response: {e}")
+            return self._chat_error_response(e)
+    
+    async def chat_with_context_async(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]] = None,
+        max_context_tokens: int = 4000
+    ) -> Dict[str, any]:
+        """
+        Async chat_with_context for use directly from endpoints
+        
+        The prompt is built on the calling thread (cheap); only the
+        blocking Gemini call is offloaded to a worker thread.
+        
+        Args:
+            query: User's question
+            context_chunks: Retrieved chunks from Pinecone
+            chat_history: Previous conversation messages
+            max_context_tokens: Token budget for the document context
             
-            # Generate response with increased max_output_tokens
-            generation_config = {
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 2048,  # Increased from default 1024 to 2048
-            }
+        Returns:
+            Response dictionary with answer, sources, and metadata
+        """
+        if not context_chunks:
+            return self._no_context_response()
+        
+        cache_key = self._answer_key(query, context_chunks, chat_history, max_context_tokens)
+        cached = self._get_cached_answer(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            prompt, sources = self._build_chat_prompt(query, context_chunks, chat_history, max_context_tokens)
+            model, model_name = self._route_chat_model(query, context_chunks, chat_history)
             
-            response = self.model.generate_content(
+            response = await asyncio.to_thread(
+                model.generate_content,
                 prompt,
-                generation_config=generation_config
+                generation_config=self.CHAT_GENERATION_CONFIG
             )
             
-            # Extract sources from chunks
-            sources = self._extract_sources(context_chunks)
-            
-            # Convert inline citations to clickable links
-            answer = self._convert_citations_to_links(response.text, sources)
-            
-            return {
-                'success': True,
-                'answer': answer,
-                'sources': sources,
-                'num_chunks': len(context_chunks),
-                'model': 'gemini-2.0-flash-exp'
-            }
+            return self._cache_answer(
+                cache_key, self.finalize_answer(response.text, context_chunks, sources, model_name)
+            )
             
         except Exception as e:
             logger.error(f"Error generating chat response: {e}")
-            return {
-                'success': False,
-                'answer': f"I apologize, but I encountered an error: {str(e)}",
-                'sources': [],
-                'num_chunks': 0,
-                'model': 'gemini-2.0-flash-exp'
-            }
+            return self._chat_error_response(e)
+    
+    @property
+    def token_scale(self) -> float:
+        """
+        Gemini tokens per locally counted token, measured once on a sample
+        
+        count_tokens approximates Gemini's tokenizer; one count_tokens API
+        call (made on a background thread, see _start_token_scale_calibration)
+        calibrates it so the context budget matches what Gemini actually
+        bills. Never blocks: 1.0 is used until calibration succeeds.
+        """
+        if self._token_scale is None:
+            self._start_token_scale_calibration()
+            return 1.0
+        return self._token_scale
+    
+    def _start_token_scale_calibration(self):
+        """Calibrate token_scale on a background thread (one attempt at a time, retried after failures)"""
+        with self._token_scale_lock:
+            if self._token_scale is not None or time.monotonic() < self._token_scale_retry_at:
+                return
+            # Holds off further attempts while this one runs, and after it fails
+            self._token_scale_retry_at = time.monotonic() + self.TOKEN_SCALE_RETRY_SECONDS
+        threading.Thread(target=self._calibrate_token_scale, daemon=True).start()
+    
+    def _calibrate_token_scale(self):
+        """Measure the Gemini/local token ratio (blocking count_tokens call)"""
+        try:
+            gemini_tokens = self.model.count_tokens(RAG_SYSTEM_INSTRUCTION).total_tokens
+            low, high = self.TOKEN_SCALE_BOUNDS
+            scale = min(max(gemini_tokens / count_tokens(RAG_SYSTEM_INSTRUCTION), low), high)
+            self._token_scale = scale
+            logger.info(f"Context token scale calibrated against Gemini: {scale:.2f}")
+        except Exception as e:
+            logger.warning(f"Could not calibrate token counts against Gemini (retrying later): {e}")
+    
+    def _route_chat_model(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]]
+    ) -> Tuple[genai.GenerativeModel, str]:
+        """Pick the chat model tier from a cheap complexity score; returns (model, model name)"""
+        complexity = len(query.split()) + 2 * len(context_chunks) + len(chat_history or [])
+        if complexity < self.LITE_COMPLEXITY_THRESHOLD:
+            return self.chat_lite_model, self.CHAT_LITE_MODEL
+        return self.chat_model, self.CHAT_MODEL
+    
+    def _build_chat_prompt(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]],
+        max_context_tokens: int
+    ) -> Tuple[str, List[Dict]]:
+        """Build the full RAG prompt from retrieved chunks and history; returns (prompt, sources)"""
+        # Build context (and the sources list, from the same pass) from chunks
+        context_text, sources = self._get_context(context_chunks, max_context_tokens)
+        
+        # Build conversation history
+        history_text = self._build_history(chat_history) if chat_history else ""
+        
+        logger.info(f"Generating response for query: {query[:100]}...")
+        logger.info(f"  Context chunks: {len(context_chunks)}")
+        logger.info(f"  History messages: {len(chat_history) if chat_history else 0}")
+        
+        # Create RAG prompt
+        return self._create_rag_prompt(query, context_text, history_text), sources
+    
+    def _answer_key(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]],
+        max_context_tokens: int
+    ) -> str:
+        """Cache key: normalized query, retrieved chunk ids, and the last few history turns"""
+        chunk_ids = sorted(str(chunk.get('id') or chunk.get('text', '')) for chunk in context_chunks)
+        history_tail = self._build_history(chat_history[-4:]) if chat_history else ""
+        h = hashlib.sha256(" ".join(query.lower().split()).encode())
+        h.update(f"|{max_context_tokens}|".encode())
+        h.update("\x1f".join(chunk_ids).encode())
+        h.update(b"|")
+        h.update(hashlib.md5(history_tail.encode()).digest())
+        return h.hexdigest()
+    
+    def _get_cached_answer(self, key: str) -> Optional[Dict[str, any]]:
+        """Unexpired cached answer for key (as a copy), or None"""
+        with self._answer_cache_lock:
+            entry = self._answer_cache.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._answer_cache[key]
+                entry = None
+            if entry is None:
+                self._answer_cache_misses += 1
+                return None
+            self._answer_cache.move_to_end(key)
+            self._answer_cache_hits += 1
+            hits, misses = self._answer_cache_hits, self._answer_cache_misses
+        
+        logger.info(f"✓ Answer cache hit ({hits} hits / {misses} misses)")
+        return {**entry[1], 'sources': [dict(source) for source in entry[1]['sources']]}
+    
+    def _cache_answer(self, key: str, result: Dict[str, any]) -> Dict[str, any]:
+        """Remember a successful answer under key; returns result unchanged"""
+        if result.get('success'):
+            with self._answer_cache_lock:
+                self._answer_cache[key] = (time.monotonic() + self.ANSWER_CACHE_TTL, result)
+                self._answer_cache.move_to_end(key)
+                if len(self._answer_cache) > self.ANSWER_CACHE_SIZE:
+                    self._answer_cache.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _no_context_response() -> Dict[str, any]:
+        """Response used when retrieval returned no chunks"""
+        return {
+            'success': True,
+            'answer': NO_CONTEXT_ANSWER,
+            'sources': [],
+            'num_chunks': 0,
+            'model': 'gemini-2.0-flash-exp'
+        }
+    
+    @staticmethod
+    def _chat_error_response(error: Exception) -> Dict[str, any]:
+        """Response used when answer generation failed"""
+        return {
+            'success': False,
+            'answer': f"I apologize, but I encountered an error: {str(error)}",
+            'sources': [],
+            'num_chunks': 0,
+            'model': 'gemini-2.0-flash-exp'
+        }
+    
+    def chat_with_context_stream(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]] = None,
+        max_context_tokens: int = 4000
+    ) -> Iterator[str]:
+        """
+        Stream a RAG chat response as it is generated
+        
+        Same prompt as chat_with_context. Yields raw text deltas; pass the
+        joined text to finalize_answer for sources and citation links.
+        
+        Args:
+            query: User's question
+            context_chunks: Retrieved chunks from Pinecone
+            chat_history: Previous conversation messages
+            max_context_tokens: Token budget for the document context
+            
+        Yields:
+            Text fragments of the answer
+        """
+        if not context_chunks:
+            # Nothing to ground an answer in; skip the Gemini round-trip
+            yield NO_CONTEXT_ANSWER
+            return
+        
+        prompt, _ = self._build_chat_prompt(query, context_chunks, chat_history, max_context_tokens)
+        model, _ = self._route_chat_model(query, context_chunks, chat_history)
+        
+        response = model.generate_content(
+            prompt,
+            generation_config=self.CHAT_GENERATION_CONFIG,
+            stream=True
+        )
+        
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish_reason chunk)
+                continue
+            if text:
+                yield text
+    
+    def chat_with_context_events(
+        self,
+        query: str,
+        context_chunks: List[Dict],
+        chat_history: Optional[List[Dict]] = None,
+        max_context_tokens: int = 4000,
+        sources: Optional[List[Dict]] = None
+    ) -> Iterator[Tuple[str, Optional[Dict[str, any]]]]:
+        """
+        Stream a RAG chat response, then its final response dictionary
+        
+        Shares chat_with_context's answer cache: a cached answer is yielded
+        whole, and a freshly streamed answer is cached once complete.
+        
+        Args:
+            query: User's question
+            context_chunks: Retrieved chunks from Pinecone
+            chat_history: Previous conversation messages
+            max_context_tokens: Token budget for the document context
+            sources: Sources from context_sources for these chunks, if already known
+            
+        Yields:
+            (delta, None) per text fragment, then ("", response) with the
+            dictionary chat_with_context would return
+        """
+        if not context_chunks:
+            yield NO_CONTEXT_ANSWER, None
+            yield "", self._no_context_response()
+            return
+        
+        cache_key = self._answer_key(query, context_chunks, chat_history, max_context_tokens)
+        cached = self._get_cached_answer(cache_key)
+        if cached is not None:
+            yield cached['answer'], None
+            yield "", cached
+            return
+        
+        parts = []
+        for delta in self.chat_with_context_stream(query, context_chunks, chat_history, max_context_tokens):
+            parts.append(delta)
+            yield delta, None
+        
+        _, model_name = self._route_chat_model(query, context_chunks, chat_history)
+        if sources is None:
+            sources = self.context_sources(context_chunks, max_context_tokens)
+        yield "", self._cache_answer(
+            cache_key, self.finalize_answer("".join(parts), context_chunks, sources, model_name)
+        )
+    
+    def finalize_answer(
+        self,
+        text: str,
+        context_chunks: List[Dict],
+        sources: Optional[List[Dict]] = None,
+        model_name: Optional[str] = None
+    ) -> Dict[str, any]:
+        """
+        Attach sources to a generated answer and link its citations
+        
+        Args:
+            text: Raw answer text from Gemini
+            context_chunks: Chunks the answer was generated from
+            sources: Sources already extracted from context_chunks, if any
+            model_name: Chat model that generated the answer (default CHAT_MODEL)
+            
+        Returns:
+            Response dictionary with answer, sources, and metadata
+        """
+        # Extract sources from chunks
+        if sources is None:
+            sources = self.extract_sources(context_chunks)
+        
+        # Convert inline citations to clickable links
+        answer = self._convert_citations_to_links(text, sources)
+        
+        return {
+            'success': True,
+            'answer': answer,
+            'sources': sources,
+            'num_chunks': len(context_chunks),
+            'model': model_name or self.CHAT_MODEL
+        }
+    
+    def _get_context(self, chunks: List[Dict], max_tokens: int) -> Tuple[str, List[Dict]]:
+        """
+        (context string, sources) for these chunks, reusing the pair built
+        for an identical retrieval (same chunk ids, order and shown scores)
+        """
+        key = self._context_key(chunks, max_tokens)
+        with self._context_cache_lock:
+            entry = self._context_cache.get(key)
+            if entry is not None:
+                self._context_cache.move_to_end(key)
+        
+        if entry is None:
+            entry = self._build_context(chunks, max_tokens)
+            with self._context_cache_lock:
+                self._context_cache[key] = entry
+                if len(self._context_cache) > self.CONTEXT_CACHE_SIZE:
+                    self._context_cache.popitem(last=False)
+        
+        # Sources end up in responses; hand out copies of the cached ones
+        context, sources = entry
+        return context, [{**source, 'pages': list(source['pages'])} for source in sources]
     
-    def _build_context(self, chunks: List[Dict], max_length: int) -> str:
-        """Build context string from retrieved chunks, grouped by page"""
+    @staticmethod
+    def _context_key(chunks: List[Dict], max_tokens: int) -> bytes:
+        """Digest of everything _build_context output depends on"""
+        h = hashlib.blake2b(str(max_tokens).encode(), digest_size=16)
+        for chunk in chunks:
+            # A vector id pins text/page/filename/url; else the text and its document
+            ident = chunk.get('id') or f"{chunk.get('text', '')}\x1d{chunk.get('pdf_url', '')}"
+            h.update(f"\x1f{ident}\x1e{chunk.get('score', 0):.2f}".encode())
+        return h.digest()
+    
+    def _build_context(self, chunks: List[Dict], max_tokens: int) -> Tuple[str, List[Dict]]:
+        """
+        Build context string from retrieved chunks, grouped by page, within a token budget
+        
+        Also returns the sources of the pages that made it into the context
+        (as extract_sources would, minus pages dropped by the cutoff or budget),
+        so citations only point at pages the model saw.
+        
+        When every chunk has a vector 'score', pages go in best-first by
+        average score and assembly stops at the first page below
+        CONTEXT_RELEVANCE_CUTOFF times the best one, so weak matches don't
+        dilute the prompt. Otherwise (keyword/hybrid results, already ranked)
+        pages keep retrieval order. Either way the token budget applies.
+        """
         context_parts = []
-        total_length = 0
+        total_tokens = 0
+        scale = self.token_scale
         
         # Group chunks by page number
         pages_dict = {}
         for chunk in chunks:
-            page = chunk.get('page_num', 'unknown')
-            if page not in pages_dict:
-                pages_dict[page] = []
-            pages_dict[page].append(chunk)
+            pages_dict.setdefault(chunk.get('page_num', 'unknown'), []).append(chunk)
+        
+        # Average score per page
+        scored_pages = [
+            (sum(chunk.get('score', 0) for chunk in page_chunks) / len(page_chunks), page, page_chunks)
+            for page, page_chunks in pages_dict.items()
+        ]
+        min_score = float('-inf')
+        if scored_pages and all('score' in chunk for chunk in chunks):
+            # Best first (ties keep retrieval order); cut relative to a positive best score
+            scored_pages.sort(key=lambda item: -item[0])
+            if scored_pages[0][0] > 0:
+                min_score = scored_pages[0][0] * self.CONTEXT_RELEVANCE_CUTOFF
         
-        # Create context with page-based numbering
+        # Create context with page-based numbering (in insertion order)
         page_num = 1
-        for page, page_chunks in pages_dict.items():
-            # Combine all chunks from the same page
-            page_texts = [chunk.get('text', '') for chunk in page_chunks]
-            combined_text = '\n'.join(page_texts)
+        included_pages = set()
+        for avg_score, page, page_chunks in scored_pages:
+            if avg_score < min_score:
+                break
+            
+            # Combine all chunks from the same page, minus overlap and extra whitespace
+            combined_text = compress_page_text([chunk.get('text', '') for chunk in page_chunks])
             
             filename = page_chunks[0].get('filename', 'unknown')
-            avg_score = sum(chunk.get('score', 0) for chunk in page_chunks) / len(page_chunks)
             
             # Format with page number as source
             chunk_text = f"\n[Source {page_num}] (Page {page}, {filename}, Relevance: {avg_score:.2f})\n{combined_text}\n"
             
-            # Check length
-            if total_length + len(chunk_text) > max_length:
+            # Check token budget (local count scaled to Gemini's tokenizer)
+            chunk_tokens = count_tokens(chunk_text) * scale
+            if total_tokens + chunk_tokens > max_tokens:
                 break
             
             context_parts.append(chunk_text)
-            total_length += len(chunk_text)
+            included_pages.add(page)
+            total_tokens += chunk_tokens
             page_num += 1
         
-        return "\n".join(context_parts)
+        # Sources for the included pages only (in retrieval order)
+        sources = {}
+        for chunk in chunks:
+            if chunk.get('page_num', 'unknown') in included_pages:
+                _add_source(sources, chunk)
+        
+        return "\n".join(context_parts), _sorted_sources(sources)
     
     def _build_history(self, history: List[Dict]) -> str:
         """Build conversation history string"""
         if not history:
             return ""
         
+        prefix = self.HISTORY_ROLE_PREFIX
+        history = history[-10:]  # Last 10 messages
+        split = len(history) - self.HISTORY_RAW_MESSAGES
         history_parts = ["Previous conversation:"]
-        
-        for msg in history[-10:]:  # Last 10 messages
-            role = msg.get('role', 'user')
-            message = msg.get('message', '')
-            
-            if role == 'user':
-                history_parts.append(f"User: {message}")
-            else:
-                history_parts.append(f"Assistant: {message}")
+        history_parts += [
+            f"{prefix.get(msg.get('role', 'user'), 'Assistant: ')}"
+            f"{clip_message(msg.get('message', ''), self.HISTORY_CLIP_CHARS) if i < split else msg.get('message', '')}"
+            for i, msg in enumerate(history)
+        ]
         
         return "\n".join(history_parts)
     
     def _create_rag_prompt(self, query: str, context: str, history: str) -> str:
-        """Create RAG prompt with context and history"""
-        
-        prompt_parts = []
-        
-        # System instruction
-        prompt_parts.append("""You are a helpful AI assistant that answers questions based on the provided document context.
-
-IMPORTANT INSTRUCTIONS:
-- Provide comprehensive, detailed answers in a natural, conversational style
-- Use **markdown formatting** sparingly and strategically:
-  * Use **bold** ONLY for 2-3 most important terms or section titles
-  * Use bullet points (- or numbers) for lists
-  * Use ## for main section headings (use sparingly, 1-2 max)
-- Write in clear, flowing paragraphs (3-5 paragraphs for complex questions)
-- Answer based ONLY on the information in the context below
-
-CRITICAL - CITATION RULES:
-- When referencing information, cite the source number [1], [2], [3] etc.
-- Each source number corresponds to a PAGE in the document (not individual chunks)
-- Place citations strategically - NOT after every sentence
-- Cite once per paragraph or when introducing new information from a specific page
-- Multiple facts from the same page can share one citation at the end
-- DO NOT over-cite - keep it clean and readable
-
-CITATION EXAMPLES:
-
-✅ CORRECT (minimal citations):
-Sanket Rajendra Shinde is a Software Development Engineer seeking opportunities. He has experience at Neurolaw AI where he developed custom RAG pipelines, integrated Cloud OCR, and built real-time court scrapers [1]. 
-
-His technical skills include Full Stack development, Cloud technologies, and AI/ML & GenAI [1]. He has several projects including Quickmed and InterviewAce [1].
-
-❌ WRONG (too many citations):
-Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1]. He has skills [1].
-""")
-        
-        # Add conversation history if present
-        if history:
-            prompt_parts.append(f"\n{history}\n")
+        """Create RAG prompt with context and history (system instruction lives on chat_model)"""
         
-        # Add context
-        prompt_parts.append(f"\nRELEVANT CONTEXT FROM DOCUMENTS:\n{context}\n")
-        
-        # Add current query
-        prompt_parts.append(f"\nCURRENT QUESTION: {query}\n")
-        prompt_parts.append("\nANSWER (use markdown formatting):")
-        
-        return "\n".join(prompt_parts)
+        # Optional history, context, then the question, each section
+        # separated by a blank line
+        history_block = f"{history}\n\n" if history else ""
+        return (
+            f"{history_block}"
+            f"RELEVANT CONTEXT FROM DOCUMENTS:\n{context}\n\n"
+            f"CURRENT QUESTION: {query}\n\n"
+            f"ANSWER (use markdown formatting):"
+        )
     
     def _convert_citations_to_links(self, text: str, sources: List[Dict]) -> str:
         """
@@ -209,58 +825,38 @@ Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1].
         [1] -> [1](url#page=1)
         [2] -> [2](url#page=2)
         """
-        import re
+        # One link per source (1-indexed by citation number), built once;
+        # first page for the link - convert to int to remove .0
+        links = [
+            f"{source['url']}#page={int(source['pages'][0]) if source['pages'] else 1}"
+            for source in sources
+        ]
         
-        # Find all [1], [2], [3] patterns
         def replace_citation(match):
             citation_num = int(match.group(1))
-            
-            # Get the corresponding source (1-indexed)
-            if 0 < citation_num <= len(sources):
-                source = sources[citation_num - 1]
-                url = source['url']
-                pages = source['pages']
-                
-                # Use first page for the link - convert to int to remove .0
-                page = int(pages[0]) if pages else 1
-                link = f"{url}#page={page}"
-                
+            if 0 < citation_num <= len(links):
                 # Create clickable citation - single brackets only
-                return f'[{citation_num}]({link})'
-            
+                return f'[{citation_num}]({links[citation_num - 1]})'
             return match.group(0)  # Return original if source not found
         
         # Replace all [1], [2], [3] etc with clickable links
-        converted_text = re.sub(r'\[(\d+)\]', replace_citation, text)
+        return _CITATION_RE.sub(replace_citation, text)
+    
+    def context_sources(self, chunks: List[Dict], max_context_tokens: int = 4000) -> List[Dict]:
+        """
+        Sources of the pages the prompt's context will include for these chunks
         
-        return converted_text
+        Same budget and cutoff as the prompt (and the same cached build), so
+        it can be sent before the answer is generated.
+        """
+        return self._get_context(chunks, max_context_tokens)[1]
     
-    def _extract_sources(self, chunks: List[Dict]) -> List[Dict]:
-        """Extract unique sources from chunks"""
+    def extract_sources(self, chunks: List[Dict]) -> List[Dict]:
+        """Extract unique sources from chunks (single pass; pages deduped in a set)"""
         sources = {}
-        
         for chunk in chunks:
-            pdf_url = chunk.get('pdf_url')
-            filename = chunk.get('filename')
-            page = chunk.get('page_num')
-            
-            if pdf_url and pdf_url not in sources:
-                sources[pdf_url] = {
-                    'url': pdf_url,
-                    'filename': filename,
-                    'pages': [page] if page else []
-                }
-            elif pdf_url and page:
-                if page not in sources[pdf_url]['pages']:
-                    sources[pdf_url]['pages'].append(page)
-        
-        # Convert to list and sort pages
-        result = []
-        for source in sources.values():
-            source['pages'] = sorted(set(source['pages']))
-            result.append(source)
-        
-        return result
+            _add_source(sources, chunk)
+        return _sorted_sources(sources)
     
     def analyze_image(self, image_path: str, context: str = "") -> Dict[str, str]:
         """
@@ -273,12 +869,25 @@ Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1].
         Returns:
             Dictionary with analysis results
         """
-        try:
-            # Load the image
-            img = Image.open(image_path)
+        # Create prompt for image analysis
+        return self.analyze_image_with_prompt(image_path, self._create_analysis_prompt(context))
+    
+    def analyze_image_with_prompt(self, image_path: str, prompt: str) -> Dict[str, str]:
+        """
+        Analyze a single image with an already built analysis prompt
+        
+        Lets callers build the (page-level) prompt once for all of a page's images.
+        
+        Args:
+            image_path: Path to the image file
+            prompt: Prompt from _create_analysis_prompt
             
-            # Create prompt for image analysis
-            prompt = self._create_analysis_prompt(context)
+        Returns:
+            Dictionary with analysis results
+        """
+        try:
+            # Send the encoded file (downscaled once if oversized; no SDK re-encode)
+            img = image_part(image_path)
             
             # Generate content using Gemini
             response = self.model.generate_content([prompt, img])
@@ -297,6 +906,69 @@ Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1].
                 'model': 'gemini-2.0-flash-exp'
             }
     
+    async def analyze_image_async(self, image_path: str, context: str = "") -> Dict[str, str]:
+        """
+        Async analyze_image; the blocking Gemini call runs in a worker thread
+        
+        Args:
+            image_path: Path to the image file
+            context: Optional context about the image (e.g., page text)
+            
+        Returns:
+            Dictionary with analysis results
+        """
+        return await asyncio.to_thread(self.analyze_image, image_path, context)
+    
+    def analyze_images_batch(self, image_paths: List[str], context: str = "") -> List[Dict[str, str]]:
+        """
+        Analyze several images from the same page in one Gemini request
+        
+        The shared prompt is sent once with all images attached; Gemini is
+        asked for a JSON array with one description per image. If the reply
+        can't be parsed into exactly one entry per image, each image is
+        analyzed on its own instead.
+        
+        Args:
+            image_paths: Paths to the image files (one page's worth)
+            context: Optional context about the images (e.g., page text)
+            
+        Returns:
+            One analysis dict per image, in input order (same shape as analyze_image)
+        """
+        # One prompt for the whole page, shared by every image below
+        prompt = self._create_analysis_prompt(context)
+        if len(image_paths) == 1:
+            return [self.analyze_image_with_prompt(image_paths[0], prompt)]
+        
+        try:
+            parts = [
+                prompt
+                + f"\n\nThere are {len(image_paths)} images below. Analyze each one separately and "
+                "return a JSON array of strings, one analysis per image, in the same order."
+            ]
+            for num, image_path in enumerate(image_paths, start=1):
+                parts.append(f"Image {num}:")
+                parts.append(image_part(image_path))
+            
+            response = self.model.generate_content(
+                parts,
+                generation_config={"response_mime_type": "application/json"}
+            )
+            descriptions = json.loads(response.text)
+            
+            if (not isinstance(descriptions, list) or len(descriptions) != len(image_paths)
+                    or not all(isinstance(d, str) for d in descriptions)):
+                raise ValueError(f"expected {len(image_paths)} descriptions in the batch reply")
+            
+            return [
+                {'success': True, 'description': description, 'model': 'gemini-2.0-flash-exp'}
+                for description in descriptions
+            ]
+            
+        except Exception as e:
+            logger.warning(f"Batched image analysis failed ({e}), analyzing images one by one")
+            return [self.analyze_image_with_prompt(image_path, prompt) for image_path in image_paths]
+    
     def analyze_multiple_images(
         self, 
         images: List[Dict], 
@@ -312,33 +984,46 @@ Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1].
         Returns:
             List of analysis results
         """
-        results = []
+        return asyncio.run(self.analyze_multiple_images_async(images, page_text))
+    
+    async def analyze_multiple_images_async(
+        self,
+        images: List[Dict],
+        page_text: str = "",
+        max_concurrency: int = 8
+    ) -> List[Dict]:
+        """
+        Analyze multiple images from a page concurrently
         
-        for img_info in images:
-            image_path = img_info.get('filepath')
-            
-            # Skip if no valid filepath (e.g., Supabase images without local path)
-            if not image_path:
-                logger.debug(f"Skipping image without filepath: {img_info.get('filename', 'unknown')}")
-                continue
-                
-            # Skip if file doesn't exist
-            if not Path(image_path).exists():
-                logger.debug(f"Skipping non-existent image: {image_path}")
-                continue
-            
-            logger.info(f"Analyzing image: {img_info.get('filename')}")
-            
-            analysis = self.analyze_image(image_path, context=page_text)
+        Images are sent IMAGE_BATCH_SIZE at a time per Gemini request. A batch
+        that raises doesn't cancel the others; its images are marked as failed.
+        
+        Args:
+            images: List of image info dicts with 'filepath' key
+            page_text: Text from the same page for context
+            max_concurrency: Maximum concurrent Gemini requests
             
-            # Add analysis to image info
-            result = {
-                **img_info,
-                'gemini_analysis': analysis['description'],
-                'analysis_success': analysis['success']
-            }
-            results.append(result)
+        Returns:
+            List of analysis results, in input order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        images = local_images(images)
+        size = self.IMAGE_BATCH_SIZE
+        chunks = [images[i:i + size] for i in range(0, len(images), size)]
+        batches = await asyncio.gather(
+            *[analyze_batch(self, chunk, page_text, semaphore) for chunk in chunks],
+            return_exceptions=True
+        )
         
+        results = []
+        for chunk, batch in zip(chunks, batches):
+            if isinstance(batch, Exception):
+                logger.error(f"Error analyzing image batch: {batch}")
+                batch = [
+                    {**img_info, 'gemini_analysis': f"Error: {str(batch)}", 'analysis_success': False}
+                    for img_info in chunk
+                ]
+            results.extend(batch)
         return results
     
     def _create_analysis_prompt(self, context: str = "") -> str:
@@ -351,21 +1036,8 @@ Sanket [1] is a Software Development Engineer [1]. He works at Neurolaw AI [1].
         Returns:
             Prompt string
         """
-        base_prompt = """Analyze this image in detail. Provide:
-1. What type of visual is this? (chart, diagram, graph, table, photo, illustration, etc.)
-2. What is the main subject or purpose?
-3. Key information or data shown
-4. Any text visible in the image
-5. How this relates to the document context
-
-Be concise but thorough."""
-        
-        if context:
-            # Truncate context if too long
-            context_preview = context[:500] if len(context) > 500 else context
-            base_prompt += f"\n\nDocument context: {context_preview}"
-        
-        return base_prompt
+        # Keep only as much page text as fits the preview budget
+        return _analysis_prompt(context_preview(context) if context else "")
     
     def analyze_chart_data(self, image_path: str) -> Dict:
         """
@@ -378,7 +1050,7 @@ Be concise but thorough."""
             Extracted data and insights
         """
         try:
-            img = Image.open(image_path)
+            img = image_part(image_path)
             
             prompt = """This appears to be a chart or graph. Please extract:
 1. Chart type (bar, line, pie, scatter, etc.)
@@ -407,6 +1079,61 @@ Provide the information in a structured format."""
             }
 
 
+@functools.lru_cache(maxsize=4)
+def get_analyzer(api_key: str) -> GeminiVisionAnalyzer:
+    """
+    Shared analyzer per API key
+    
+    Every caller (uploads, chat) reuses one analyzer, so they share its
+    model client and connections as well as its context/answer caches.
+    """
+    return GeminiVisionAnalyzer(api_key)
+
+
+# Longest image side sent to Gemini; larger images are downscaled in memory
+# when their request is built (nothing is written to disk)
+MAX_IMAGE_SIDE = 1024
+
+
+def image_part(image_path: str) -> Dict:
+    """
+    Inline image part for generate_content from the file's encoded bytes
+    
+    Images within MAX_IMAGE_SIDE are sent as-is; larger ones are sent as a
+    copy downscaled in memory (smaller upload, fewer vision tokens).
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        {'mime_type': ..., 'data': bytes}; mime type is guessed from the extension
+    """
+    mime_type, _ = mimetypes.guess_type(image_path)
+    if not mime_type or not mime_type.startswith('image/'):
+        mime_type = 'image/png'
+    data = Path(image_path).read_bytes()
+    
+    try:
+        # Image.open only parses the header here; pixels load if we resize
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= MAX_IMAGE_SIDE:
+                return {'mime_type': mime_type, 'data': data}
+            
+            is_jpeg = img.format == 'JPEG'
+            img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+            buffer = io.BytesIO()
+            if is_jpeg:
+                img.save(buffer, format='JPEG', quality=90)
+            else:
+                img.save(buffer, format='PNG', optimize=True)
+        
+        return {'mime_type': 'image/jpeg' if is_jpeg else 'image/png', 'data': buffer.getvalue()}
+        
+    except Exception as e:
+        logger.warning(f"Could not downscale {image_path}, sending original: {e}")
+        return {'mime_type': mime_type, 'data': data}
+
+
 def analyze_pdf_images(
     extraction_result: Dict,
     api_key: str
@@ -421,14 +1148,133 @@ def analyze_pdf_images(
     Returns:
         Updated extraction result with Gemini analysis
     """
-    analyzer = GeminiVisionAnalyzer(api_key)
+    # Images from every page overlap instead of running page by page
+    return asyncio.run(analyze_pdf_images_async(extraction_result, api_key))
+
+
+def local_images(images: List[Dict]) -> List[Dict]:
+    """
+    Images that can be analyzed: those with a filepath that exists locally
     
-    for page in extraction_result['pages']:
+    Args:
+        images: List of image info dicts
+        
+    Returns:
+        Filtered list, in input order
+    """
+    result = []
+    for img_info in images:
+        image_path = img_info.get('filepath')
+        
+        # Skip if no valid filepath (e.g., Supabase images without local path)
+        if not image_path:
+            logger.debug(f"Skipping image without filepath: {img_info.get('filename', 'unknown')}")
+            continue
+        
+        # Skip if file doesn't exist
+        if not Path(image_path).exists():
+            logger.debug(f"Skipping non-existent image: {image_path}")
+            continue
+        
+        result.append(img_info)
+    return result
+
+
+async def analyze_batch(
+    analyzer: GeminiVisionAnalyzer,
+    images: List[Dict],
+    page_text: str = "",
+    semaphore: Optional[asyncio.Semaphore] = None
+) -> List[Dict]:
+    """
+    Analyze a group of images from one page in a single request, off the event loop
+    
+    Args:
+        analyzer: Gemini analyzer to use
+        images: Image info dicts with 'filepath' keys (at most IMAGE_BATCH_SIZE)
+        page_text: Text from the same page for context
+        semaphore: Optional semaphore limiting concurrent Gemini requests
+        
+    Returns:
+        Image infos with Gemini analysis added, in input order
+    """
+    paths = [img_info['filepath'] for img_info in images]
+    if semaphore is None:
+        analyses = await asyncio.to_thread(analyzer.analyze_images_batch, paths, page_text)
+    else:
+        async with semaphore:
+            analyses = await asyncio.to_thread(analyzer.analyze_images_batch, paths, page_text)
+    
+    return [
+        {
+            **img_info,
+            'gemini_analysis': analysis['description'],
+            'analysis_success': analysis['success']
+        }
+        for img_info, analysis in zip(images, analyses)
+    ]
+
+
+async def analyze_pdf_images_async(
+    extraction_result: Dict,
+    api_key: str,
+    max_concurrency: int = 8,
+    max_pending_results: int = 32
+) -> Dict:
+    """
+    Analyze all images in a PDF extraction result concurrently
+    
+    Each page's images go to Gemini in batches of up to IMAGE_BATCH_SIZE per
+    request. Each call runs in a worker thread; a semaphore caps the number
+    of in-flight requests so large PDFs don't trip rate limits, and at most
+    max_pending_results batches are scheduled at a time.
+    
+    Args:
+        extraction_result: PDF extraction result from pdf_extractor
+        api_key: Google API key
+        max_concurrency: Maximum concurrent Gemini requests
+        max_pending_results: Maximum batches scheduled but not yet collected
+        
+    Returns:
+        Updated extraction result with Gemini analysis
+    """
+    analyzer = get_analyzer(api_key)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    # Flatten to (page index, image batch, page text); only images on local disk
+    size = GeminiVisionAnalyzer.IMAGE_BATCH_SIZE
+    jobs = []
+    for page_idx, page in enumerate(extraction_result['pages']):
+        images = local_images(page['images'])
         if page['images']:
-            logger.info(f"Analyzing {len(page['images'])} images on page {page['page_num']}")
-            page['images'] = analyzer.analyze_multiple_images(
-                page['images'],
-                page_text=page['text']
-            )
+            logger.info(f"Analyzing {len(images)} images on page {page['page_num']}")
+        jobs.extend(
+            (page_idx, images[i:i + size], page['text'])
+            for i in range(0, len(images), size)
+        )
+    
+    analyzed: List[Optional[List[Dict]]] = [None] * len(jobs)
+    
+    async def run(position: int, images: List[Dict], page_text: str):
+        analyzed[position] = await analyze_batch(analyzer, images, page_text, semaphore)
+    
+    # Sliding window: wait for a slot before scheduling the next batch
+    pending = set()
+    for position, (_, images, page_text) in enumerate(jobs):
+        if len(pending) >= max_pending_results:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        pending.add(asyncio.create_task(run(position, images, page_text)))
+    if pending:
+        await asyncio.gather(*pending)
+    
+    # Replace each page's images with its analyzed images, in original order
+    page_results: Dict[int, List[Dict]] = {}
+    for (page_idx, _, _), results in zip(jobs, analyzed):
+        page_results.setdefault(page_idx, []).extend(results)
+    for page_idx, page in enumerate(extraction_result['pages']):
+        if page['images']:
+            page['images'] = page_results.get(page_idx, [])
     
     return extraction_result
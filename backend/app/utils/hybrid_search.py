@@ -4,12 +4,18 @@ Uses Reciprocal Rank Fusion (RRF) for score combination - FREE algorithm
 """
 
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
-from app.utils.bm25_index import search_bm25
+import numpy as np
+from app.utils.bm25_index import search_bm25, search_bm25_scores, _top_k_indices
 from app.utils.pinecone_storage import get_pinecone_storage
 
 logger = logging.getLogger(__name__)
 
+# Shared pool so the BM25 lookup and the Pinecone query run side by side
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
 
 class HybridSearch:
     """
@@ -45,6 +51,9 @@ class HybridSearch:
         """
         Hybrid search combining BM25 and vector search
         
+        The BM25 lookup and the Pinecone query run concurrently, so latency is
+        the slower of the two rather than their sum.
+        
         Args:
             session_id: Session identifier
             query: Search query
@@ -54,15 +63,22 @@ class HybridSearch:
         Returns:
             Combined and reranked results
         """
+        # Start both retrievals before waiting on either
+        bm25_future = _RETRIEVAL_POOL.submit(search_bm25_scores, session_id, query, 10)
+        vector_future = _RETRIEVAL_POOL.submit(
+            self._vector_search, session_id, query, max(top_k, 10), namespace
+        )
+        
+        # Vector search handles its own errors (returns [] on failure)
+        vector_results = vector_future.result()
+        logger.info(f"Vector search found {len(vector_results)} results")
+        
         try:
-            # Get BM25 results
-            bm25_results = search_bm25(session_id, query, top_k=10)
+            # Get BM25 hits as (idx, score) pairs into the indexed chunks
+            bm25_chunks, bm25_hits = bm25_future.result()
+            bm25_results = [bm25_chunks[idx] for idx, _ in bm25_hits]
             logger.info(f"BM25 found {len(bm25_results)} results")
             
-            # Get vector search results
-            vector_results = self._vector_search(session_id, query, top_k=10, namespace=namespace)
-            logger.info(f"Vector search found {len(vector_results)} results")
-            
             # Combine using RRF
             combined_results = self._reciprocal_rank_fusion(
                 bm25_results,
@@ -75,8 +91,8 @@ class HybridSearch:
             
         except Exception as e:
             logger.error(f"Error in hybrid search: {e}")
-            # Fallback to vector search only
-            return self._vector_search(session_id, query, top_k, namespace)
+            # Fallback to vector search only (results already fetched)
+            return vector_results[:top_k]
     
     def _vector_search(
         self,
@@ -117,63 +133,47 @@ class HybridSearch:
         Score = sum(1 / (k + rank)) for each result list
         
         RRF is a simple, effective, and FREE reranking method
-        """
-        # Create a map of chunk_id -> result with combined scores
-        fusion_map = {}
         
-        # Process BM25 results
-        for rank, result in enumerate(bm25_results, start=1):
-            chunk_id = self._get_chunk_id(result)
-            rrf_score = 1 / (self.rrf_k + rank)
-            
-            fusion_map[chunk_id] = {
-                'chunk': result,
-                'bm25_rank': rank,
-                'bm25_rrf': rrf_score,
-                'vector_rrf': 0,
-                'total_score': rrf_score * self.bm25_weight
-            }
+        Scores are accumulated in NumPy arrays indexed by first appearance of
+        each chunk id; only the final top_k are turned back into dicts.
+        """
+        # chunk_id -> position in the score arrays (first appearance wins)
+        ids: Dict[str, int] = {}
+        chunks: List[Dict] = []
+        limit = len(bm25_results) + len(vector_results)
+        bm25_rank = np.zeros(limit, dtype=np.int32)  # 0 = not in that list
+        vector_rank = np.zeros(limit, dtype=np.int32)
         
-        # Process vector results
-        for rank, result in enumerate(vector_results, start=1):
-            chunk_id = self._get_chunk_id(result)
-            rrf_score = 1 / (self.rrf_k + rank)
-            
-            if chunk_id in fusion_map:
-                # Chunk found in both - add vector score
-                fusion_map[chunk_id]['vector_rank'] = rank
-                fusion_map[chunk_id]['vector_rrf'] = rrf_score
-                fusion_map[chunk_id]['total_score'] += rrf_score * self.vector_weight
-            else:
-                # New chunk from vector search
-                fusion_map[chunk_id] = {
-                    'chunk': result,
-                    'bm25_rrf': 0,
-                    'vector_rank': rank,
-                    'vector_rrf': rrf_score,
-                    'total_score': rrf_score * self.vector_weight
-                }
+        for ranks, results in ((bm25_rank, bm25_results), (vector_rank, vector_results)):
+            for rank, result in enumerate(results, start=1):
+                chunk_id = self._get_chunk_id(result)
+                idx = ids.get(chunk_id)
+                if idx is None:
+                    idx = ids[chunk_id] = len(chunks)
+                    chunks.append(result)
+                ranks[idx] = rank
         
-        # Sort by total RRF score
-        sorted_results = sorted(
-            fusion_map.values(),
-            key=lambda x: x['total_score'],
-            reverse=True
-        )[:top_k]
+        n = len(chunks)
+        bm25_rank, vector_rank = bm25_rank[:n], vector_rank[:n]
+        bm25_rrf = np.where(bm25_rank > 0, 1.0 / (self.rrf_k + bm25_rank), 0.0)
+        vector_rrf = np.where(vector_rank > 0, 1.0 / (self.rrf_k + vector_rank), 0.0)
+        total = self.bm25_weight * bm25_rrf + self.vector_weight * vector_rrf
         
-        # Build final result list with metadata
+        # Build final result list with metadata (only the top_k winners
+        # are copied; BM25 entries still reference the indexed chunks).
+        # Ties keep first-appearance order, as the old stable sort did.
         final_results = []
-        for item in sorted_results:
-            chunk = item['chunk'].copy()
-            chunk['hybrid_score'] = item['total_score']
+        for idx in _top_k_indices(total, top_k):
+            chunk = chunks[idx].copy()
+            chunk['hybrid_score'] = float(total[idx])
             chunk['search_method'] = 'hybrid'
             
             # Add ranking details
             chunk['ranking_details'] = {
-                'bm25_rank': item.get('bm25_rank'),
-                'vector_rank': item.get('vector_rank'),
-                'bm25_rrf': item['bm25_rrf'],
-                'vector_rrf': item['vector_rrf']
+                'bm25_rank': int(bm25_rank[idx]) or None,
+                'vector_rank': int(vector_rank[idx]) or None,
+                'bm25_rrf': float(bm25_rrf[idx]),
+                'vector_rrf': float(vector_rrf[idx])
             }
             
             final_results.append(chunk)
@@ -194,9 +194,10 @@ class HybridSearch:
             chunk_id = chunk.get('chunk_id', '')
             return f"{doc_id}_{chunk_id}"
         
-        # Fallback: hash of text
-        text = chunk.get('text', '')
-        return str(hash(text))
+        # Fallback: stable digest of the normalized text (str hash() is
+        # randomized per process); whitespace/case-only variants share an id
+        text = " ".join(chunk.get('text', '').split()).lower()
+        return hashlib.blake2b(text.encode("utf-8", "ignore"), digest_size=8).hexdigest()
 
 
 def hybrid_search(
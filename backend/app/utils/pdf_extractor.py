@@ -8,16 +8,54 @@ import fitz  # PyMuPDF
 from PIL import Image
 import io
 import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 import logging
 from app.utils.supabase_storage import get_storage_client
 
+try:
+    import fpnge  # optional SIMD PNG encoder
+except ImportError:  # fall back to Pillow's zlib encoder
+    fpnge = None
+
+try:
+    from numba import njit  # optional JIT for the per-image filter stats
+except ImportError:  # fall back to NumPy
+    njit = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Image modes fpnge can encode directly
+FPNGE_MODES = {'L', 'LA', 'RGB', 'RGBA'}
+
+
+def encode_png(pil_image: Image.Image, compress_level: int = 1) -> bytes:
+    """
+    Encode an image as PNG bytes, with fpnge when it's installed
+    
+    Args:
+        pil_image: PIL Image object
+        compress_level: zlib level for the Pillow fallback
+        
+    Returns:
+        PNG file bytes
+    """
+    if fpnge is not None and pil_image.mode in FPNGE_MODES:
+        try:
+            return fpnge.fromPIL(pil_image)
+        except Exception as e:
+            logger.debug(f"fpnge failed ({e}), encoding with Pillow")
+    
+    img_byte_arr = io.BytesIO()
+    pil_image.save(img_byte_arr, format='PNG', compress_level=compress_level)
+    return img_byte_arr.getvalue()
+
 
 class PDFExtractor:
     """
@@ -25,6 +63,20 @@ class PDFExtractor:
     Uploads images to Supabase Storage
     """
     
+    # zlib level for PNGs re-encoded by Pillow (when fpnge isn't installed):
+    # level 1 is several times faster than PIL's default 6 for a few percent
+    # larger files (they're uploaded as-is)
+    PNG_COMPRESS_LEVEL = 1
+    
+    # Max side of the nearest-neighbour samples used to count an image's
+    # colors: for the useless-image filter, and for type classification
+    COLOR_SAMPLE_SIZE = 128
+    CLASSIFY_SAMPLE_SIZE = 512
+    
+    # Pages whose images may still be finishing (classify/encode/upload) on
+    # the helper thread while later pages are parsed
+    PREFETCH_PAGES = 2
+    
     def __init__(self, use_supabase: bool = True):
         """
         Initialize the PDF extractor
@@ -74,32 +126,11 @@ class PDFExtractor:
         result = {
             'doc_id': doc_id,
             'total_pages': len(pdf_document),
-            'pages': []
+            'pages': self.extract_pages(pdf_document, range(len(pdf_document)), doc_id)
         }
         
-        # Process each page
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            
-            page_data = {
-                'page_num': page_num + 1,  # 1-indexed for user-friendliness
-                'text': '',
-                'images': []
-            }
-            
-            # Extract text
-            page_data['text'] = self._extract_text_from_page(page)
-            
-            # Extract images
-            page_data['images'] = self._extract_images_from_page(
-                page, 
-                doc_id, 
-                page_num + 1
-            )
-            
-            result['pages'].append(page_data)
-            
-            logger.info(f"Processed page {page_num + 1}/{len(pdf_document)}: "
+        for page_data in result['pages']:
+            logger.info(f"Processed page {page_data['page_num']}/{result['total_pages']}: "
                        f"{len(page_data['text'])} chars, {len(page_data['images'])} images")
         
         pdf_document.close()
@@ -107,6 +138,67 @@ class PDFExtractor:
         logger.info(f"Extraction complete: {result['total_pages']} pages processed")
         return result
     
+    def extract_pages(self, pdf_document: fitz.Document, page_indices: range, doc_id: str) -> List[Dict]:
+        """
+        Extract a run of pages, overlapping PyMuPDF parsing with image finishing
+        
+        PyMuPDF isn't thread-safe, so all of its work (text, image bytes,
+        filtering) stays on this thread, while one helper thread classifies,
+        encodes and uploads the images of the pages before. At most
+        PREFETCH_PAGES pages are in flight at a time.
+        
+        Args:
+            pdf_document: Open PyMuPDF document
+            page_indices: 0-based page indices to extract, in order
+            doc_id: Unique document identifier
+            
+        Returns:
+            Page dictionaries in page order (same shape as extract_page)
+        """
+        pages = []
+        pending = deque()
+        
+        def collect():
+            page_num, text, images = pending.popleft()
+            pages.append({'page_num': page_num, 'text': text, 'images': images.result()})
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-finish") as finisher:
+            for page_index in page_indices:
+                page = pdf_document[page_index]
+                page_num = page.number + 1  # 1-indexed for user-friendliness
+                text = self._extract_text_from_page(page)
+                candidates = self._collect_page_images(page, page_num)
+                pending.append((
+                    page_num,
+                    text,
+                    finisher.submit(self._finish_page_images, candidates, doc_id, page_num)
+                ))
+                if len(pending) > self.PREFETCH_PAGES:
+                    collect()
+            while pending:
+                collect()
+        
+        return pages
+    
+    def extract_page(self, page: fitz.Page, doc_id: str) -> Dict:
+        """
+        Extract text and images from a single page
+        
+        Args:
+            page: PyMuPDF page object
+            doc_id: Unique document identifier
+            
+        Returns:
+            Page dictionary with 'page_num', 'text' and 'images'
+        """
+        page_num = page.number + 1  # 1-indexed for user-friendliness
+        
+        return {
+            'page_num': page_num,
+            'text': self._extract_text_from_page(page),
+            'images': self._extract_images_from_page(page, doc_id, page_num)
+        }
+    
     def _extract_text_from_page(self, page: fitz.Page) -> str:
         """
         Extract text from a single page
@@ -136,9 +228,28 @@ class PDFExtractor:
         Returns:
             List of image metadata dictionaries (filtered to meaningful images only)
         """
-        images = []
+        return self._finish_page_images(self._collect_page_images(page, page_num), doc_id, page_num)
+    
+    def _collect_page_images(self, page: fitz.Page, page_num: int) -> List[Tuple]:
+        """
+        Pull a page's images out of the PDF and drop useless ones
+        
+        Everything that touches PyMuPDF happens here (see extract_pages).
+        
+        Args:
+            page: PyMuPDF page object
+            page_num: Page number (1-indexed)
+            
+        Returns:
+            (img_num, image_bytes, image_ext, bbox, pil_image, pixels) per kept
+            image, in page order; pixels is the RGB decode made for the filters
+        """
+        candidates = []
         image_list = page.get_images(full=True)
         
+        # Where each image appears on the page, from one content-stream pass
+        bbox_map = self._get_image_bboxes(page) if image_list else {}
+        
         for img_num, img_info in enumerate(image_list, start=1):
             try:
                 # Get image reference
@@ -150,69 +261,93 @@ class PDFExtractor:
                 image_ext = base_image["ext"]
                 
                 # Get image bounding box (where it appears on the page)
-                bbox = self._get_image_bbox(page, xref)
+                bbox = bbox_map.get(xref)
                 
-                # Open image with PIL to get dimensions and analyze
+                # Open image with PIL to get dimensions (lazy: only the header is parsed)
                 pil_image = Image.open(io.BytesIO(image_bytes))
                 width, height = pil_image.size
                 
-                # FILTER OUT USELESS IMAGES
-                if self._is_useless_image(pil_image, bbox, page):
+                # FILTER OUT USELESS IMAGES (size/placement first, so rejected
+                # backgrounds are never decoded; then one decode for the pixel filters)
+                useless = self._is_useless_placement(width, height, bbox, page)
+                if not useless:
+                    pixels = self._filter_pixels(pil_image, page, xref)
+                    useless = self._is_useless_image(pixels)
+                if useless:
                     logger.debug(f"Skipping useless image on page {page_num} (img {img_num}): {width}x{height}")
                     continue
                 
+                candidates.append((img_num, image_bytes, image_ext, bbox, pil_image, pixels))
+                
+            except Exception as e:
+                logger.error(f"Error extracting image {img_num} from page {page_num}: {e}")
+                continue
+        
+        return candidates
+    
+    def _finish_page_images(self, candidates: List[Tuple], doc_id: str, page_num: int) -> List[Dict]:
+        """
+        Classify, encode and store a page's kept images (no PyMuPDF calls)
+        
+        Args:
+            candidates: Output of _collect_page_images
+            doc_id: Document identifier
+            page_num: Page number (1-indexed)
+            
+        Returns:
+            List of image metadata dictionaries, in page order
+        """
+        images = []
+        uploads = []  # Supabase uploads, sent together once the page is processed
+        
+        for img_num, image_bytes, image_ext, bbox, pil_image, pixels in candidates:
+            try:
+                width, height = pil_image.size
+                
                 # Determine image type (chart/diagram vs photo)
-                img_type = self._classify_image_type(pil_image, image_bytes)
+                img_type = self._classify_image_type(pixels)
                 
                 # Generate filename
                 filename = f"{doc_id}_page_{page_num}_img_{img_num}.png"
                 
-                # Convert to PNG bytes
-                img_byte_arr = io.BytesIO()
-                pil_image.save(img_byte_arr, format='PNG')
-                img_byte_arr.seek(0)
-                png_bytes = img_byte_arr.getvalue()
+                # Convert to PNG bytes (embedded PNGs are already PNG; no decode/re-encode)
+                if image_ext == 'png':
+                    png_bytes = image_bytes
+                elif pil_image.mode == 'RGB':
+                    # Same pixels as the filter decode; encode those instead of decoding again
+                    png_bytes = encode_png(Image.fromarray(pixels), self.PNG_COMPRESS_LEVEL)
+                else:
+                    png_bytes = encode_png(pil_image, self.PNG_COMPRESS_LEVEL)
                 
                 # Upload to Supabase Storage or save locally
                 if self.use_supabase and self.storage_client:
-                    # Upload to Supabase
-                    storage_path = f"images/{doc_id}/{filename}"
-                    upload_result = self.storage_client.upload_bytes(
-                        file_bytes=png_bytes,
-                        storage_path=storage_path,
-                        content_type='image/png'
-                    )
-                    
-                    image_data = {
-                        'img_num': img_num,
-                        'filename': filename,
-                        'storage_path': upload_result['path'],
-                        'url': upload_result['url'],
+                    # Queue for the concurrent Supabase upload below
+                    uploads.append((png_bytes, f"images/{doc_id}/{filename}", img_num, filename, {
                         'bbox': bbox,
                         'width': width,
                         'height': height,
                         'type': img_type,
                         'original_ext': image_ext
-                    }
-                    logger.info(f"✓ Uploaded to Supabase: {filename} ({width}x{height}, type={img_type})")
-                else:
-                    # Save locally (fallback)
-                    local_dir = Path("uploads/extracted")
-                    local_dir.mkdir(parents=True, exist_ok=True)
-                    save_path = local_dir / filename
-                    pil_image.save(save_path, "PNG")
-                    
-                    image_data = {
-                        'img_num': img_num,
-                        'filename': filename,
-                        'filepath': str(save_path),
-                        'bbox': bbox,
-                        'width': width,
-                        'height': height,
-                        'type': img_type,
-                        'original_ext': image_ext
-                    }
-                    logger.info(f"✓ Saved locally: {filename} ({width}x{height}, type={img_type})")
+                    }))
+                    continue
+                
+                # Save locally (fallback)
+                local_dir = Path("uploads/extracted")
+                local_dir.mkdir(parents=True, exist_ok=True)
+                save_path = local_dir / filename
+                save_path.write_bytes(png_bytes)
+                
+                image_data = {
+                    'img_num': img_num,
+                    'filename': filename,
+                    'filepath': str(save_path),
+                    'bbox': bbox,
+                    'width': width,
+                    'height': height,
+                    'type': img_type,
+                    'original_ext': image_ext
+                }
+                logger.info(f"✓ Saved locally: {filename} ({width}x{height}, type={img_type})")
                 
                 images.append(image_data)
                 
@@ -220,48 +355,125 @@ class PDFExtractor:
                 logger.error(f"Error extracting image {img_num} from page {page_num}: {e}")
                 continue
         
+        if uploads:
+            images.extend(self._upload_images(uploads, page_num))
+        
         return images
     
-    def _get_image_bbox(self, page: fitz.Page, xref: int) -> List[float]:
+    def _upload_images(self, uploads: List[Tuple], page_num: int) -> List[Dict]:
+        """
+        Upload a page's images to Supabase Storage concurrently
+        
+        Uploads are I/O-bound, so they share a small thread pool and the page
+        waits about one round-trip instead of one per image.
+        
+        Args:
+            uploads: (png_bytes, storage_path, img_num, filename, metadata) per image, in page order
+            page_num: Page number (1-indexed)
+            
+        Returns:
+            Image metadata dictionaries in page order (failed uploads left out)
+        """
+        def upload(job: Tuple) -> Optional[Dict]:
+            png_bytes, storage_path, img_num, filename, metadata = job
+            try:
+                upload_result = self.storage_client.upload_bytes(
+                    file_bytes=png_bytes,
+                    storage_path=storage_path,
+                    content_type='image/png'
+                )
+            except Exception as e:
+                logger.error(f"Error extracting image {img_num} from page {page_num}: {e}")
+                return None
+            
+            logger.info(f"✓ Uploaded to Supabase: {filename} "
+                        f"({metadata['width']}x{metadata['height']}, type={metadata['type']})")
+            return {
+                'img_num': img_num,
+                'filename': filename,
+                'storage_path': upload_result['path'],
+                'url': upload_result['url'],
+                **metadata
+            }
+        
+        if len(uploads) == 1:
+            results = [upload(uploads[0])]
+        else:
+            results = _get_upload_pool().map(upload, uploads)
+        return [image_data for image_data in results if image_data is not None]
+    
+    def _get_image_bboxes(self, page: fitz.Page) -> Dict[int, List[float]]:
+        """
+        Get bounding box coordinates for every image on a page
+        
+        One page.get_image_info() call walks the content stream once, instead
+        of a page.get_image_rects() walk per image.
+        
+        Args:
+            page: PyMuPDF page object
+            
+        Returns:
+            Map of image xref to the bounding box [x0, y0, x1, y1] of its
+            first instance on the page (images not found are absent)
+        """
+        bboxes = {}
+        try:
+            for info in page.get_image_info(xrefs=True):
+                xref = info.get('xref', 0)
+                if xref and xref not in bboxes:
+                    bboxes[xref] = list(info['bbox'])
+        except Exception as e:
+            logger.warning(f"Could not get image bboxes for page {page.number + 1}: {e}")
+        return bboxes
+    
+    def _filter_pixels(self, pil_image: Image.Image, page: fitz.Page, xref: int) -> np.ndarray:
         """
-        Get bounding box coordinates for an image on a page
+        Decoded RGB pixels for the image filters
+        
+        Decodes with PyMuPDF straight from the PDF stream (in C, no PIL
+        decode/convert), falling back to PIL for images PyMuPDF can't turn
+        into RGB (e.g. stencil masks).
         
         Args:
+            pil_image: PIL Image object (used only by the fallback)
             page: PyMuPDF page object
             xref: Image reference number
             
         Returns:
-            Bounding box as [x0, y0, x1, y1] or None if not found
+            uint8 array of shape (height, width, 3)
         """
         try:
-            # Get all image instances on the page
-            image_instances = page.get_image_rects(xref)
-            
-            if image_instances:
-                # Return the first instance's bounding box
-                rect = image_instances[0]
-                return [rect.x0, rect.y0, rect.x1, rect.y1]
-            else:
-                return None
+            pix = fitz.Pixmap(page.parent, xref)
+            if pix.alpha:
+                pix = fitz.Pixmap(pix, 0)  # drop alpha
+            if pix.n != 3:
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
         except Exception as e:
-            logger.warning(f"Could not get bbox for image xref {xref}: {e}")
-            return None
+            logger.debug(f"Pixmap decode failed for xref {xref} ({e}), using PIL")
+            return np.asarray(pil_image.convert('RGB'))
     
-    def _is_useless_image(self, pil_image: Image.Image, bbox: List[float], page: fitz.Page) -> bool:
+    def _is_useless_placement(
+        self,
+        width: int,
+        height: int,
+        bbox: List[float],
+        page: fitz.Page
+    ) -> bool:
         """
-        Determine if an image is useless (watermark, background, gradient, etc.)
+        Determine from size and position alone if an image is a decoration
+        or background (no pixel decode needed)
         
         Args:
-            pil_image: PIL Image object
+            width: Image width in pixels
+            height: Image height in pixels
             bbox: Bounding box [x0, y0, x1, y1] or None
             page: PyMuPDF page object
             
         Returns:
-            True if image should be filtered out, False if it's meaningful
+            True if image should be filtered out
         """
         try:
-            width, height = pil_image.size
-            
             # Filter 1: Extremely small images (likely icons, bullets, decorations)
             MIN_SIZE = 50
             if width < MIN_SIZE or height < MIN_SIZE:
@@ -283,43 +495,55 @@ class PDFExtractor:
                     logger.debug(f"Filter: Full page coverage ({coverage_x:.1%} x {coverage_y:.1%})")
                     return True
             
-            # Filter 3: Check for gradients (very few colors but smooth transitions)
-            # Convert to RGB for analysis
-            if pil_image.mode != 'RGB':
-                analysis_image = pil_image.convert('RGB')
-            else:
-                analysis_image = pil_image
-            
-            # Get unique colors
-            colors = analysis_image.getcolors(maxcolors=256*256)
-            
-            if colors is not None:
-                unique_colors = len(colors)
-                total_pixels = width * height
-                
-                # Filter 3a: Very few colors (1-20) = likely gradient, watermark, or solid color
-                if unique_colors < 20:
-                    logger.debug(f"Filter: Too few colors ({unique_colors})")
-                    return True
-                
-                # Filter 3b: Check color dominance - if one color is >90%, likely useless
-                if colors:
-                    max_color_count = max(count for count, _ in colors)
-                    dominance = max_color_count / total_pixels
-                    if dominance > 0.90:
-                        logger.debug(f"Filter: Single color dominance ({dominance:.1%})")
-                        return True
+            return False
             
-            # Filter 4: Check for very low contrast (gradients often have low contrast)
-            # Sample pixels and check variance
-            import numpy as np
+        except Exception as e:
+            logger.warning(f"Error in image filtering: {e}")
+            # On error, keep the image (conservative approach)
+            return False
+    
+    def _is_useless_image(self, pixels: np.ndarray) -> bool:
+        """
+        Determine from its pixels if an image is useless (watermark, gradient, etc.)
+        
+        Run after _is_useless_placement, on the decode from _filter_pixels.
+        Filters are cost-ordered and each works on the smallest buffer already
+        made: the full decode is read once for a strided sample, which feeds
+        the color filters and then the 32x32 patch for contrast and edges.
+        
+        Args:
+            pixels: RGB uint8 array of shape (height, width, 3), both sides >= 50
             
-            # Resize to small size for quick analysis
-            small_img = analysis_image.resize((32, 32), Image.Resampling.LANCZOS)
-            img_array = np.array(small_img)
+        Returns:
+            True if image should be filtered out, False if it's meaningful
+        """
+        try:
+            height, width = pixels.shape[:2]
             
-            # Calculate standard deviation across all channels
-            std_dev = np.std(img_array)
+            # Filter 3: Check for gradients (very few colors but smooth transitions)
+            # Unique colors from a strided sample (no blended colors)
+            sample = _strided_sample(pixels, self.COLOR_SAMPLE_SIZE)
+            packed = _packed_colors(sample)
+            _, counts = np.unique(packed, return_counts=True)
+            unique_colors = len(counts)
+            
+            # Filter 3a: Very few colors (1-20) = likely gradient, watermark, or solid color
+            if unique_colors < 20:
+                logger.debug(f"Filter: Too few colors ({unique_colors})")
+                return True
+            
+            # Filter 3b: Check color dominance - if one color is >90%, likely useless
+            dominance = counts.max() / packed.size
+            if dominance > 0.90:
+                logger.debug(f"Filter: Single color dominance ({dominance:.1%})")
+                return True
+            
+            # Filter 4: Check for very low contrast (gradients often have low contrast)
+            # Box-average the sample to 32x32 for quick analysis (still a smoothed
+            # downscale, unlike picking 32x32 pixels); std dev across all channels
+            # and edge counts (for filter 5) come from one pass over the patch
+            img_array = _box_downsample(sample, 32)
+            std_dev, edge_count = _patch_stats(img_array)
             
             # Low std dev = low contrast = likely gradient/watermark
             if std_dev < 15:  # Threshold for low variance
@@ -327,15 +551,7 @@ class PDFExtractor:
                 return True
             
             # Filter 5: Check edge density (meaningful images have more edges)
-            # Simple edge detection using color differences
-            gray = small_img.convert('L')
-            gray_array = np.array(gray)
-            
-            # Calculate horizontal and vertical gradients
-            h_grad = np.abs(np.diff(gray_array, axis=1))
-            v_grad = np.abs(np.diff(gray_array, axis=0))
-            
-            edge_density = (np.sum(h_grad > 20) + np.sum(v_grad > 20)) / (32 * 32)
+            edge_density = edge_count / (32 * 32)
             
             # Very low edge density = smooth gradient or plain background
             if edge_density < 0.05:
@@ -343,7 +559,7 @@ class PDFExtractor:
                 return True
             
             # Image passed all filters - it's likely meaningful!
-            logger.debug(f"✓ Image passed filters: {width}x{height}, colors={unique_colors if colors else 'many'}, std={std_dev:.1f}, edges={edge_density:.3f}")
+            logger.debug(f"✓ Image passed filters: {width}x{height}, colors={unique_colors}, std={std_dev:.1f}, edges={edge_density:.3f}")
             return False
             
         except Exception as e:
@@ -351,7 +567,7 @@ class PDFExtractor:
             # On error, keep the image (conservative approach)
             return False
     
-    def _classify_image_type(self, pil_image: Image.Image, image_bytes: bytes) -> str:
+    def _classify_image_type(self, pixels: np.ndarray) -> str:
         """
         Classify image as chart/diagram vs photo
         
@@ -359,29 +575,17 @@ class PDFExtractor:
         For better results, you could use ML models.
         
         Args:
-            pil_image: PIL Image object
-            image_bytes: Raw image bytes
+            pixels: RGB uint8 array of shape (height, width, 3) from _filter_pixels
             
         Returns:
             'chart', 'diagram', 'photo', or 'unknown'
         """
         try:
             # Simple heuristics:
-            # 1. Check color mode
-            # 2. Check color diversity
-            # 3. Check size
-            
-            width, height = pil_image.size
-            mode = pil_image.mode
-            
-            # Convert to RGB if needed for analysis
-            if mode != 'RGB':
-                analysis_image = pil_image.convert('RGB')
-            else:
-                analysis_image = pil_image
+            # 1. Check color diversity
+            # 2. Check size
             
-            # Get color statistics
-            colors = analysis_image.getcolors(maxcolors=256*256)
+            height, width = pixels.shape[:2]
             
             # Heuristics:
             # - Charts/diagrams typically have fewer unique colors
@@ -391,15 +595,18 @@ class PDFExtractor:
             if width < 100 or height < 100:
                 return 'diagram'
             
-            if colors is not None and len(colors) < 100:
+            # Get color statistics (on a strided sample of the already decoded pixels)
+            unique_colors = len(np.unique(_packed_colors(_strided_sample(pixels, self.CLASSIFY_SAMPLE_SIZE))))
+            
+            if unique_colors < 100:
                 # Low color diversity -> likely chart/diagram
                 return 'chart'
             
-            if colors is None or len(colors) > 10000:
+            if unique_colors > 10000:
                 # High color diversity -> likely photo
                 return 'photo'
             
-            if len(colors) < 1000:
+            if unique_colors < 1000:
                 return 'diagram'
             
             return 'photo'
@@ -409,6 +616,85 @@ class PDFExtractor:
             return 'unknown'
 
 
+def _strided_sample(pixels: np.ndarray, max_side: int) -> np.ndarray:
+    """
+    Nearest-neighbour sample of an (H, W, C) image with sides <= max_side
+    (a strided view, nothing is copied)
+    """
+    step_y = -(-pixels.shape[0] // max_side)
+    step_x = -(-pixels.shape[1] // max_side)
+    return pixels[::step_y, ::step_x]
+
+
+def _packed_colors(pixels: np.ndarray) -> np.ndarray:
+    """
+    Colors of an (H, W, 3) uint8 image, each pixel packed into one uint32
+    (r<<16 | g<<8 | b)
+    """
+    rgb = pixels.reshape(-1, 3).astype(np.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+def _box_downsample(pixels: np.ndarray, size: int) -> np.ndarray:
+    """
+    Average an (H, W, C) uint8 image into a size x size grid
+    
+    Edge rows/columns that don't fill a whole block are dropped; both
+    sides must be at least size.
+    """
+    h = pixels.shape[0] // size * size
+    w = pixels.shape[1] // size * size
+    blocks = pixels[:h, :w].reshape(size, h // size, size, w // size, pixels.shape[2])
+    return blocks.mean(axis=(1, 3)).round().astype(np.uint8)
+
+
+def _patch_stats_numpy(patch: np.ndarray) -> Tuple[float, int]:
+    """
+    Std dev and edge count of an (H, W, 3) uint8 patch
+    
+    Edges are horizontal/vertical neighbour differences above 20 in uint8
+    luma (PIL's convert('L') integer weights), differences taken in uint8
+    as np.diff does.
+    """
+    rgb = patch.astype(np.uint32)
+    gray = ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+    h_grad = np.diff(gray, axis=1)
+    v_grad = np.diff(gray, axis=0)
+    return float(np.std(patch)), int(np.sum(h_grad > 20) + np.sum(v_grad > 20))
+
+
+def _patch_stats_loop(patch):
+    """Single-pass loop version of _patch_stats_numpy, compiled with Numba"""
+    height, width = patch.shape[0], patch.shape[1]
+    total = 0.0
+    total_sq = 0.0
+    edges = 0
+    prev_row = np.empty(width, dtype=np.int64)
+    for y in range(height):
+        prev = 0
+        for x in range(width):
+            r = np.int64(patch[y, x, 0])
+            g = np.int64(patch[y, x, 1])
+            b = np.int64(patch[y, x, 2])
+            total += r + g + b
+            total_sq += r * r + g * g + b * b
+            gray = (r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16
+            if x > 0 and ((gray - prev) & 0xFF) > 20:
+                edges += 1
+            if y > 0 and ((gray - prev_row[x]) & 0xFF) > 20:
+                edges += 1
+            prev = gray
+            prev_row[x] = gray
+    n = height * width * 3
+    mean = total / n
+    return np.sqrt(max(total_sq / n - mean * mean, 0.0)), edges
+
+
+# Filter stats for the 32x32 patch: one JIT-compiled pass when Numba is
+# installed, where NumPy's per-call overhead dominates on arrays this small
+_patch_stats = njit(cache=True)(_patch_stats_loop) if njit is not None else _patch_stats_numpy
+
+
 # Convenience function for simple usage
 def extract_pdf(pdf_path: str, doc_id: str, use_supabase: bool = True) -> Dict:
     """
@@ -425,3 +711,100 @@ def extract_pdf(pdf_path: str, doc_id: str, use_supabase: bool = True) -> Dict:
     extractor = PDFExtractor(use_supabase=use_supabase)
     return extractor.extract_text_and_images(pdf_path, doc_id)
     return extractor.extract_text_and_images(pdf_path, doc_id)
+
+
+# Process pool for per-page extraction (created lazily, shared across uploads)
+MAX_PAGE_WORKERS = min(os.cpu_count() or 1, 4)
+_process_pool = None
+_worker_extractors = {}
+
+# Concurrent Supabase image uploads per process (I/O-bound)
+MAX_UPLOAD_WORKERS = 8
+_upload_pool = None
+
+
+def _get_upload_pool() -> ThreadPoolExecutor:
+    """Get or create the image upload thread pool (one per process)"""
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS, thread_name_prefix="image-upload")
+    return _upload_pool
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Get or create the page extraction process pool"""
+    global _process_pool
+    if _process_pool is None:
+        # "spawn" avoids forking a parent that already runs threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=MAX_PAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def _extract_pages_worker(job: Tuple[str, str, int, int, bool]) -> List[Dict]:
+    """
+    Extract a contiguous range of pages inside a worker process
+    
+    PyMuPDF documents are not picklable, so each job re-opens the PDF by
+    path (once for its whole page range) and reuses one extractor (and
+    storage client) per process.
+    """
+    pdf_path, doc_id, start, stop, use_supabase = job
+    
+    extractor = _worker_extractors.get(use_supabase)
+    if extractor is None:
+        extractor = _worker_extractors[use_supabase] = PDFExtractor(use_supabase=use_supabase)
+    
+    with fitz.open(pdf_path) as pdf_document:
+        return extractor.extract_pages(pdf_document, range(start, stop), doc_id)
+
+
+def extract_pdf_parallel(pdf_path: str, doc_id: str, use_supabase: bool = True) -> Dict:
+    """
+    Extract text and images across a process pool, one job per page range
+    
+    Pages are split into about two ranges per worker (so uneven pages still
+    balance out); each job opens the PDF once for its range. Ranges are
+    collected as they finish and the pages put back in order.
+    
+    Args:
+        pdf_path: Path to PDF file
+        doc_id: Document identifier
+        use_supabase: If True, upload to Supabase; if False, save locally
+        
+    Returns:
+        Extraction results dictionary (same structure as extract_pdf)
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        total_pages = len(pdf_document)
+    
+    # Not worth the IPC overhead for single-page documents
+    if total_pages <= 1:
+        return extract_pdf(pdf_path, doc_id, use_supabase=use_supabase)
+    
+    logger.info(f"Processing PDF in parallel: {pdf_path} ({total_pages} pages)")
+    
+    pool = _get_process_pool()
+    range_size = -(-total_pages // (MAX_PAGE_WORKERS * 2))  # ceil
+    futures = [
+        pool.submit(
+            _extract_pages_worker,
+            (pdf_path, doc_id, start, min(start + range_size, total_pages), use_supabase)
+        )
+        for start in range(0, total_pages, range_size)
+    ]
+    
+    pages = []
+    for future in as_completed(futures):
+        pages.extend(future.result())
+        logger.info(f"Extracted {len(pages)}/{total_pages} pages")
+    pages.sort(key=lambda page: page['page_num'])
+    
+    logger.info(f"Extraction complete: {total_pages} pages processed")
+    return {
+        'doc_id': doc_id,
+        'total_pages': total_pages,
+        'pages': pages
+    }
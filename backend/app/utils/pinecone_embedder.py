@@ -5,83 +5,250 @@ Uses Pinecone's hosted inference API for embeddings
 
 from pinecone import Pinecone
 from app.core.config import settings
+import asyncio
 import logging
-from typing import List, Dict, Union
+from collections import OrderedDict
+import hashlib
+from typing import Iterable, List, Dict, Optional, Tuple, Union
+import threading
 import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
+def quantize_embedding(embedding: List[float]) -> Tuple[List[int], float]:
+    """
+    Scalar-quantize an embedding to int8 with a single per-vector scale
+    
+    Args:
+        embedding: FP32 embedding vector
+        
+    Returns:
+        (int8 values as ints, scale) where value ~= int8 * scale
+    """
+    q, scales = quantize_embeddings(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+    return q[0].tolist(), float(scales[0])
+
+
+def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scalar-quantize a matrix of embeddings to int8, one scale per row
+    
+    Args:
+        embeddings: FP32 array of shape (N, D)
+        
+    Returns:
+        (int8 array of shape (N, D), float32 scales of shape (N,)) where
+        row i ~= q[i] * scales[i]
+    """
+    v = np.asarray(embeddings, dtype=np.float32)
+    max_abs = np.abs(v).max(axis=1) if v.shape[1] else np.zeros(len(v), dtype=np.float32)
+    scales = np.where(max_abs > 0, max_abs / np.float32(127.0), np.float32(1.0)).astype(np.float32)
+    q = np.clip(np.round(v / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales
+
+
+def dequantize_embedding(values: List[int], scale: float) -> List[float]:
+    """Reconstruct an FP32 embedding from int8 values and their scale"""
+    return (np.asarray(values, dtype=np.float32) * np.float32(scale)).tolist()
+
+
 class PineconeEmbedder:
     """
     Generate embeddings using Pinecone's hosted inference API
     No local model needed - embeddings are generated server-side
     """
     
+    # Query embeddings kept for repeated searches (LRU, keyed on normalized query)
+    QUERY_CACHE_SIZE = 1024
+    
+    # Passage embeddings kept by content hash, so repeated text (headers and
+    # footers on every page, re-uploaded documents) isn't embedded again;
+    # stored as float32 arrays, ~4 KB each at 1024 dims
+    PASSAGE_CACHE_SIZE = 4096
+    
     def __init__(self):
         """Initialize Pinecone client"""
         self.pc = Pinecone(api_key=settings.PINECONE_API_KEY)
         self.embedding_model = settings.EMBEDDING_MODEL
         self.embedding_dimensions = settings.EMBEDDING_DIMENSIONS
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._passage_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._passage_cache_lock = threading.Lock()
+        # Set on a 429 so every in-flight batch backs off, not just the one rejected
+        self._rate_limited_until = 0.0
+        self._rate_limit_lock = threading.Lock()
         logger.info(f"Pinecone embedder initialized with model: {self.embedding_model}")
     
-    def embed_texts(self, texts: List[str], batch_size: int = 96, max_retries: int = 3) -> List[List[float]]:
+    def _passage_key(self, text: str) -> bytes:
+        """Cache key for a passage embedding: hash of model and text"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.embedding_model.encode())
+        h.update(b"\0")
+        h.update(text.encode("utf-8", "surrogatepass"))
+        return h.digest()
+    
+    def _embed_batch(
+        self,
+        batch: List[str],
+        batch_num: int,
+        max_retries: int = 3
+    ) -> np.ndarray:
+        """
+        Embed one batch of passages, requesting only texts not already cached
+        
+        Args:
+            batch: Texts to embed in a single inference request
+            batch_num: 1-based batch number (for logging)
+            max_retries: Maximum number of retry attempts
+            
+        Returns:
+            float32 array of shape (len(batch), dimensions), in input order
+        """
+        keys = [self._passage_key(text) for text in batch]
+        
+        with self._passage_cache_lock:
+            found = {}
+            for key in keys:
+                cached = self._passage_cache.get(key)
+                if cached is not None:
+                    self._passage_cache.move_to_end(key)
+                    found[key] = cached
+        
+        # Unique misses only: identical texts in one batch are embedded once
+        misses = {key: text for key, text in zip(keys, batch) if key not in found}
+        if misses:
+            embeddings = self._request_batch(list(misses.values()), batch_num, max_retries)
+            new = {key: np.asarray(e, dtype=np.float32) for key, e in zip(misses, embeddings)}
+            with self._passage_cache_lock:
+                for key, embedding in new.items():
+                    self._passage_cache[key] = embedding
+                while len(self._passage_cache) > self.PASSAGE_CACHE_SIZE:
+                    self._passage_cache.popitem(last=False)
+            found.update(new)
+        
+        if len(misses) < len(batch):
+            logger.debug(f"Batch {batch_num}: {len(batch) - len(misses)}/{len(batch)} embeddings from cache")
+        return np.stack([found[key] for key in keys])
+    
+    def _request_batch(
+        self,
+        batch: List[str],
+        batch_num: int,
+        max_retries: int = 3
+    ) -> List[List[float]]:
+        """
+        Embed one batch of passages with exponential-backoff retries
+        
+        Args:
+            batch: Texts to embed in a single inference request
+            batch_num: 1-based batch number (for logging)
+            max_retries: Maximum number of retry attempts
+            
+        Returns:
+            Embedding vectors for the batch, in input order
+        """
+        logger.debug(f"Embedding batch {batch_num}: {len(batch)} texts")
+        
+        for attempt in range(max_retries):
+            self._wait_for_rate_limit()
+            try:
+                # Use Pinecone's inference API to generate embeddings
+                response = self.pc.inference.embed(
+                    model=self.embedding_model,
+                    inputs=batch,
+                    parameters={
+                        "input_type": "passage"  # or "query" for search queries
+                    }
+                )
+                
+                # Extract embeddings from response
+                return [item['values'] for item in response.data]
+                
+            except Exception as e:
+                wait_time = 2 ** attempt
+                logger.warning(f"Batch {batch_num} attempt {attempt + 1}/{max_retries} failed: {e}")
+                
+                if attempt < max_retries - 1:
+                    logger.info(f"Retrying batch in {wait_time}s...")
+                    if getattr(e, 'status', None) == 429:
+                        # Rate limited: hold back the other concurrent batches too
+                        self._set_rate_limit(wait_time)
+                        self._wait_for_rate_limit()
+                    else:
+                        time.sleep(wait_time)
+                else:
+                    logger.error(f"Batch failed after {max_retries} attempts")
+                    raise
+    
+    def _set_rate_limit(self, wait_time: float):
+        """Pause new inference requests for wait_time seconds (after a 429)"""
+        with self._rate_limit_lock:
+            self._rate_limited_until = max(self._rate_limited_until, time.monotonic() + wait_time)
+    
+    def _wait_for_rate_limit(self):
+        """Sleep until any rate-limit pause set by _set_rate_limit has passed"""
+        delay = self._rate_limited_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def embed_texts(
+        self,
+        texts: List[str],
+        batch_size: int = 96,
+        max_retries: int = 3,
+        max_concurrency: int = 4,
+        dtype: str = 'float32'
+    ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
         """
         Generate embeddings for a list of texts using Pinecone's inference API
         
+        Batches are sent concurrently (up to max_concurrency in flight) and
+        reassembled in input order. Use .tolist() on the result (or a row)
+        where plain Python floats are needed.
+        
         Args:
             texts: List of text strings to embed
             batch_size: Number of texts to embed in each batch (max 96 for Pinecone)
             max_retries: Maximum number of retry attempts per batch
+            max_concurrency: Maximum number of batches embedded at the same time
+            dtype: 'float32', or 'int8' for a quantized matrix plus per-row scales
             
         Returns:
-            List of embedding vectors
+            float32 array of shape (len(texts), dimensions), one row per text;
+            for dtype='int8', (int8 array, float32 scales of shape (len(texts),))
         """
-        if not texts:
-            return []
+        if dtype not in ('float32', 'int8'):
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
         
-        all_embeddings = []
+        if not texts:
+            empty = np.empty((0, self.embedding_dimensions), dtype=np.float32)
+            return quantize_embeddings(empty) if dtype == 'int8' else empty
         
         try:
-            # Process in batches
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                
-                logger.debug(f"Embedding batch {i//batch_size + 1}: {len(batch)} texts")
-                
-                # Retry logic for this batch
-                for attempt in range(max_retries):
-                    try:
-                        # Use Pinecone's inference API to generate embeddings
-                        response = self.pc.inference.embed(
-                            model=self.embedding_model,
-                            inputs=batch,
-                            parameters={
-                                "input_type": "passage"  # or "query" for search queries
-                            }
-                        )
-                        
-                        # Extract embeddings from response
-                        batch_embeddings = [item['values'] for item in response.data]
-                        all_embeddings.extend(batch_embeddings)
-                        break  # Success, exit retry loop
-                        
-                    except Exception as e:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"Batch {i//batch_size + 1} attempt {attempt + 1}/{max_retries} failed: {e}")
-                        
-                        if attempt < max_retries - 1:
-                            logger.info(f"Retrying batch in {wait_time}s...")
-                            time.sleep(wait_time)
-                        else:
-                            logger.error(f"Batch failed after {max_retries} attempts")
-                            raise
-                
-                # Small delay between batches to avoid rate limits
-                if i + batch_size < len(texts):
-                    time.sleep(0.1)
+            batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+            
+            if len(batches) == 1 or max_concurrency <= 1:
+                batch_results = [
+                    self._embed_batch(batch, num, max_retries)
+                    for num, batch in enumerate(batches, start=1)
+                ]
+            else:
+                with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+                    # map() yields results in submission order
+                    batch_results = list(pool.map(
+                        lambda args: self._embed_batch(*args, max_retries),
+                        enumerate(batches, start=1)
+                    ))
+            
+            all_embeddings = np.concatenate(batch_results)
             
             logger.info(f"✓ Generated {len(all_embeddings)} embeddings")
+            if dtype == 'int8':
+                return quantize_embeddings(all_embeddings)
             return all_embeddings
             
         except Exception as e:
@@ -98,13 +265,15 @@ class PineconeEmbedder:
         Returns:
             Embedding vector
         """
-        embeddings = self.embed_texts([text])
-        return embeddings[0] if embeddings else []
+        return self.embed_texts([text])[0].tolist()
     
     def embed_query(self, query: str, max_retries: int = 3) -> List[float]:
         """
         Generate embedding for a search query with retry logic
         
+        Repeated queries (same text ignoring case and extra whitespace) are
+        served from an in-memory LRU instead of another inference call.
+        
         Args:
             query: Query string
             max_retries: Maximum number of retry attempts
@@ -112,6 +281,11 @@ class PineconeEmbedder:
         Returns:
             Query embedding vector
         """
+        key = self._query_key(query)
+        cached = self._cached_query(key)
+        if cached is not None:
+            return cached
+        
         for attempt in range(max_retries):
             try:
                 response = self.pc.inference.embed(
@@ -124,7 +298,12 @@ class PineconeEmbedder:
                 
                 embedding = response.data[0]['values']
                 logger.debug(f"✓ Generated query embedding (dim={len(embedding)})")
-                return embedding
+                
+                with self._query_cache_lock:
+                    self._query_cache[key] = embedding
+                    if len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                        self._query_cache.popitem(last=False)
+                return list(embedding)
                 
             except Exception as e:
                 wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
@@ -137,33 +316,100 @@ class PineconeEmbedder:
                     logger.error(f"Error generating query embedding after {max_retries} attempts: {e}")
                     raise
     
-    def embed_chunks(self, chunks: List[Dict]) -> List[Dict]:
+    async def embed_query_async(self, query: str, max_retries: int = 3) -> List[float]:
+        """
+        embed_query without blocking the event loop
+        
+        Cache hits return directly; misses (and their retry backoff) run on a
+        worker thread, sharing the singleton's Pinecone client and its
+        connection pool.
+        """
+        cached = self._cached_query(self._query_key(query))
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.embed_query, query, max_retries)
+    
+    @staticmethod
+    def _query_key(query: str) -> str:
+        """Query cache key: text ignoring case and extra whitespace"""
+        return " ".join(query.lower().split())
+    
+    def _cached_query(self, key: str) -> Optional[List[float]]:
+        """Copy of a cached query embedding, or None"""
+        with self._query_cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is None:
+                return None
+            self._query_cache.move_to_end(key)
+        logger.debug("✓ Query embedding cache hit")
+        return list(cached)
+    
+    def embed_chunks(
+        self,
+        chunks: Iterable[Dict],
+        batch_size: int = 96,
+        max_concurrency: int = 4,
+        max_retries: int = 3
+    ) -> List[Dict]:
         """
         Add embeddings to text chunks
         
+        chunks may be any iterable, e.g. a generator yielding chunks as
+        they're produced: each batch is sent as soon as batch_size chunks have
+        arrived, so embedding overlaps with producing the rest.
+        
         Args:
-            chunks: List of chunk dictionaries with 'text' field
+            chunks: Chunk dictionaries with 'text' field (list or iterable)
+            batch_size: Number of texts per inference request
+            max_concurrency: Maximum number of batches embedded at the same time
+            max_retries: Maximum number of retry attempts per batch
             
         Returns:
-            Chunks with added 'embedding' field
+            Chunks with added 'embedding' field, in input order
         """
         try:
-            # Extract texts from chunks
-            texts = [chunk['text'] for chunk in chunks]
-            
-            logger.info(f"Embedding {len(texts)} text chunks...")
+            all_chunks: List[Dict] = []
+            batch_futures = []
             
-            # Generate embeddings
-            embeddings = self.embed_texts(texts)
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+                def submit_batch():
+                    start = len(batch_futures) * batch_size
+                    texts = [chunk['text'] for chunk in all_chunks[start:]]
+                    batch_futures.append(
+                        pool.submit(self._embed_batch, texts, len(batch_futures) + 1, max_retries)
+                    )
+                
+                for chunk in chunks:
+                    all_chunks.append(chunk)
+                    if len(all_chunks) % batch_size == 0:
+                        submit_batch()
+                
+                if len(all_chunks) % batch_size:
+                    submit_batch()
+                
+                logger.info(f"Embedding {len(all_chunks)} text chunks...")
+                
+                # Batch i holds chunks [i * batch_size, (i + 1) * batch_size);
+                # each chunk gets a row view of the float32 matrix
+                embeddings = (
+                    np.concatenate([future.result() for future in batch_futures])
+                    if batch_futures else []
+                )
             
             # Add embeddings to chunks
-            for chunk, embedding in zip(chunks, embeddings):
+            quantize = settings.QUANTIZE_EMBEDDINGS and len(all_chunks) > 0
+            if quantize:
+                # int8 + scale: 4x smaller while the chunks are held in memory
+                embeddings, scales = quantize_embeddings(embeddings)
+            for i, (chunk, embedding) in enumerate(zip(all_chunks, embeddings)):
                 chunk['embedding'] = embedding
+                if quantize:
+                    chunk['embedding_scale'] = float(scales[i])
                 chunk['embedding_model'] = self.embedding_model
                 chunk['embedding_dimensions'] = len(embedding)
             
-            logger.info(f"✓ Added embeddings to {len(chunks)} chunks")
-            return chunks
+            logger.info(f"✓ Added embeddings to {len(all_chunks)} chunks")
+            return all_chunks
             
         except Exception as e:
             logger.error(f"Error embedding chunks: {e}")
@@ -187,7 +433,7 @@ def embed_text(text: str) -> List[float]:
     return embedder.embed_text(text)
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def embed_texts(texts: List[str]) -> np.ndarray:
     """Quick function to embed multiple texts"""
     embedder = get_embedder()
     return embedder.embed_texts(texts)
@@ -197,3 +443,9 @@ def embed_query(query: str) -> List[float]:
     """Quick function to embed a query"""
     embedder = get_embedder()
     return embedder.embed_query(query)
+
+
+async def embed_query_async(query: str) -> List[float]:
+    """Quick function to embed a query without blocking the event loop"""
+    embedder = get_embedder()
+    return await embedder.embed_query_async(query)
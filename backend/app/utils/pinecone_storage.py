@@ -5,8 +5,9 @@ Stores document chunks and image metadata with embeddings in Pinecone
 
 from pinecone import Pinecone, ServerlessSpec
 from app.core.config import settings
-from app.utils.pinecone_embedder import get_embedder
+from app.utils.pinecone_embedder import get_embedder, dequantize_embedding
 import logging
+import numpy as np
 from typing import List, Dict, Optional
 import time
 import uuid
@@ -28,6 +29,7 @@ class PineconeStorage:
         # Get or create index
         self._ensure_index_exists()
         self.index = self.pc.Index(self.index_name)
+        self._parallel_indexes: Dict[int, object] = {}
         
         logger.info(f"Pinecone storage initialized with index: {self.index_name}")
     
@@ -63,6 +65,140 @@ class PineconeStorage:
             logger.error(f"Error ensuring index exists: {e}")
             raise
     
+    def _get_parallel_index(self, pool_threads: int):
+        """Get (or create) an index handle backed by a thread pool for async upserts"""
+        index = self._parallel_indexes.get(pool_threads)
+        if index is None:
+            index = self.pc.Index(self.index_name, pool_threads=pool_threads)
+            self._parallel_indexes[pool_threads] = index
+        return index
+    
+    def _build_chunk_vectors(
+        self,
+        chunks: List[Dict],
+        doc_id: str,
+        pdf_url: Optional[str] = None,
+        session_id: Optional[str] = None,
+        filename: Optional[str] = None
+    ) -> List[Dict]:
+        """Convert embedded text chunks into Pinecone vector records"""
+        vectors = []
+        
+        for i, chunk in enumerate(chunks):
+            # Generate unique vector ID
+            vector_id = f"{doc_id}_chunk_{i}"
+            
+            # Get embedding
+            embedding = chunk.get('embedding')
+            if embedding is None or len(embedding) == 0:
+                logger.warning(f"Chunk {i} has no embedding, skipping")
+                continue
+            
+            # Dense index values must be float32; expand quantized embeddings
+            if chunk.get('embedding_scale') is not None:
+                embedding = dequantize_embedding(embedding, chunk['embedding_scale'])
+            elif isinstance(embedding, np.ndarray):
+                embedding = embedding.tolist()  # upsert takes plain floats
+            
+            # Prepare metadata - only include non-None values
+            metadata = {
+                'doc_id': doc_id,
+                'chunk_id': i,
+                'text': chunk.get('text', ''),
+                'type': 'text_chunk'
+            }
+            
+            # Add optional fields only if they exist and are not None
+            if chunk.get('page_num') is not None:
+                metadata['page_num'] = chunk.get('page_num')
+            if chunk.get('length') is not None:
+                metadata['length'] = chunk.get('length')
+            if chunk.get('start_pos') is not None:
+                metadata['start_pos'] = chunk.get('start_pos')
+            
+            # Add PDF URL and session tracking
+            if pdf_url:
+                metadata['pdf_url'] = pdf_url
+            if session_id:
+                metadata['session_id'] = session_id
+            if filename:
+                metadata['filename'] = filename
+            
+            # Add any additional metadata from chunk (skip None values)
+            for key, value in chunk.items():
+                if key not in ['embedding', 'embedding_scale', 'text', 'embedding_model', 'embedding_dimensions']:
+                    if value is not None and key not in metadata:
+                        metadata[key] = value
+            
+            vectors.append({
+                'id': vector_id,
+                'values': embedding,
+                'metadata': metadata
+            })
+        
+        return vectors
+    
+    def _build_image_vectors(
+        self,
+        images: List[Dict],
+        doc_id: str,
+        pdf_url: Optional[str] = None,
+        session_id: Optional[str] = None,
+        filename: Optional[str] = None
+    ) -> List[Dict]:
+        """Embed image analyses and convert them into Pinecone vector records"""
+        embedder = get_embedder()
+        vectors = []
+        
+        for i, img in enumerate(images):
+            # Generate unique vector ID
+            vector_id = f"{doc_id}_image_{i}"
+            
+            # Get text for embedding (from Gemini analysis or description)
+            text_for_embedding = img.get('gemini_analysis', '') or img.get('caption', '') or f"Image {i+1}"
+            
+            # Generate embedding
+            try:
+                embedding = embedder.embed_text(text_for_embedding)
+            except Exception as e:
+                logger.warning(f"Could not generate embedding for image {i}: {e}")
+                continue
+            
+            # Prepare metadata
+            metadata = {
+                'doc_id': doc_id,
+                'image_id': i,
+                'type': 'image',
+                'filename': img.get('filename'),
+                'url': img.get('url'),
+                'storage_path': img.get('storage_path'),
+                'page_num': img.get('page_num'),
+                'width': img.get('width'),
+                'height': img.get('height'),
+                'image_type': img.get('type'),
+                'analysis': text_for_embedding[:1000]  # Store first 1000 chars
+            }
+            
+            # Add PDF URL and session tracking
+            if pdf_url:
+                metadata['pdf_url'] = pdf_url
+            if session_id:
+                metadata['session_id'] = session_id
+            if filename:
+                metadata['source_filename'] = filename
+            
+            # Add bounding box if available
+            if img.get('bbox'):
+                metadata['bbox'] = str(img['bbox'])
+            
+            vectors.append({
+                'id': vector_id,
+                'values': embedding,
+                'metadata': metadata
+            })
+        
+        return vectors
+    
     def store_chunks(
         self,
         chunks: List[Dict],
@@ -92,53 +228,7 @@ class PineconeStorage:
                 return {'stored': 0, 'doc_id': doc_id}
             
             # Prepare vectors for upsert
-            vectors = []
-            
-            for i, chunk in enumerate(chunks):
-                # Generate unique vector ID
-                vector_id = f"{doc_id}_chunk_{i}"
-                
-                # Get embedding
-                embedding = chunk.get('embedding')
-                if not embedding:
-                    logger.warning(f"Chunk {i} has no embedding, skipping")
-                    continue
-                
-                # Prepare metadata - only include non-None values
-                metadata = {
-                    'doc_id': doc_id,
-                    'chunk_id': i,
-                    'text': chunk.get('text', ''),
-                    'type': 'text_chunk'
-                }
-                
-                # Add optional fields only if they exist and are not None
-                if chunk.get('page_num') is not None:
-                    metadata['page_num'] = chunk.get('page_num')
-                if chunk.get('length') is not None:
-                    metadata['length'] = chunk.get('length')
-                if chunk.get('start_pos') is not None:
-                    metadata['start_pos'] = chunk.get('start_pos')
-                
-                # Add PDF URL and session tracking
-                if pdf_url:
-                    metadata['pdf_url'] = pdf_url
-                if session_id:
-                    metadata['session_id'] = session_id
-                if filename:
-                    metadata['filename'] = filename
-                
-                # Add any additional metadata from chunk (skip None values)
-                for key, value in chunk.items():
-                    if key not in ['embedding', 'text', 'embedding_model', 'embedding_dimensions']:
-                        if value is not None and key not in metadata:
-                            metadata[key] = value
-                
-                vectors.append({
-                    'id': vector_id,
-                    'values': embedding,
-                    'metadata': metadata
-                })
+            vectors = self._build_chunk_vectors(chunks, doc_id, pdf_url, session_id, filename)
             
             if not vectors:
                 logger.warning("No valid vectors to store")
@@ -196,55 +286,7 @@ class PineconeStorage:
             
             # For images, we'll use Gemini's analysis text as the searchable content
             # and generate embeddings from that
-            embedder = get_embedder()
-            vectors = []
-            
-            for i, img in enumerate(images):
-                # Generate unique vector ID
-                vector_id = f"{doc_id}_image_{i}"
-                
-                # Get text for embedding (from Gemini analysis or description)
-                text_for_embedding = img.get('gemini_analysis', '') or img.get('caption', '') or f"Image {i+1}"
-                
-                # Generate embedding
-                try:
-                    embedding = embedder.embed_text(text_for_embedding)
-                except Exception as e:
-                    logger.warning(f"Could not generate embedding for image {i}: {e}")
-                    continue
-                
-                # Prepare metadata
-                metadata = {
-                    'doc_id': doc_id,
-                    'image_id': i,
-                    'type': 'image',
-                    'filename': img.get('filename'),
-                    'url': img.get('url'),
-                    'storage_path': img.get('storage_path'),
-                    'page_num': img.get('page_num'),
-                    'width': img.get('width'),
-                    'height': img.get('height'),
-                    'image_type': img.get('type'),
-                    'analysis': text_for_embedding[:1000]  # Store first 1000 chars
-                }
-                
-                # Add PDF URL and session tracking
-                if pdf_url:
-                    metadata['pdf_url'] = pdf_url
-                if session_id:
-                    metadata['session_id'] = session_id
-                if filename:
-                    metadata['source_filename'] = filename
-                
-                # Add bounding box if available
-                if img.get('bbox'):
-                    metadata['bbox'] = str(img['bbox'])
-                
-                vectors.append({
-                    'id': vector_id,
-                    'values': embedding,
-                    'metadata': metadata
-                })
+            vectors = self._build_image_vectors(images, doc_id, pdf_url, session_id, filename)
             
             if not vectors:
                 logger.warning("No valid image vectors to store")
@@ -326,6 +368,91 @@ class PineconeStorage:
         
         return result
     
+    def store_document_parallel(
+        self,
+        extraction_result: Dict,
+        namespace: Optional[str] = None,
+        batch_size: int = 100,
+        pool_threads: int = 8
+    ) -> Dict:
+        """
+        Store complete document (chunks + images) in Pinecone with concurrent upserts
+        
+        Same result as store_document, but all batches are sent at once through
+        an index handle with its own thread pool instead of one request at a time.
+        
+        Args:
+            extraction_result: Complete extraction result with chunks and images
+            namespace: Optional namespace
+            batch_size: Vectors per upsert request
+            pool_threads: Number of concurrent upsert requests
+            
+        Returns:
+            Combined storage result
+        """
+        doc_id = extraction_result['doc_id']
+        pdf_url = extraction_result.get('pdf_url')
+        session_id = extraction_result.get('session_id')
+        filename = extraction_result.get('filename')
+        
+        try:
+            chunk_vectors = self._build_chunk_vectors(
+                extraction_result.get('chunks', []),
+                doc_id,
+                pdf_url=pdf_url,
+                session_id=session_id,
+                filename=filename
+            )
+            
+            all_images = []
+            for page in extraction_result.get('pages', []):
+                for img in page.get('images', []):
+                    img['page_num'] = page['page_num']  # Add page number
+                    all_images.append(img)
+            
+            image_vectors = self._build_image_vectors(
+                all_images,
+                doc_id,
+                pdf_url=pdf_url,
+                session_id=session_id,
+                filename=filename
+            )
+            
+            vectors = chunk_vectors + image_vectors
+            if vectors:
+                index = self._get_parallel_index(pool_threads)
+                async_results = [
+                    index.upsert(
+                        vectors=vectors[i:i + batch_size],
+                        namespace=namespace or "",
+                        async_req=True
+                    )
+                    for i in range(0, len(vectors), batch_size)
+                ]
+                # Wait for every batch; re-raises the first failed upsert
+                [r.get() for r in async_results]
+                logger.info(f"✓ Upserted {len(vectors)} vectors in {len(async_results)} parallel batches")
+            else:
+                logger.warning("No valid vectors to store")
+            
+        except Exception as e:
+            logger.error(f"Error storing document in Pinecone: {e}")
+            raise
+        
+        result = {
+            'doc_id': doc_id,
+            'session_id': session_id,
+            'chunks_stored': len(chunk_vectors),
+            'images_stored': len(image_vectors),
+            'total_vectors': len(vectors),
+            'namespace': namespace,
+            'pdf_url': pdf_url
+        }
+        
+        logger.info(f"✓ Document {doc_id} stored: {result['total_vectors']} vectors (session: {session_id})")
+        
+        return result
+    
     def query(
         self,
         query_text: str,
@@ -7,6 +7,7 @@ Determines query type and routes to appropriate handler:
 """
 
 import logging
+from functools import lru_cache
 from typing import Dict, Literal
 import re
 
@@ -14,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 QueryType = Literal["greeting", "document", "web_search"]
 
+# Normalized queries up to this length are memoized; longer ones rarely repeat
+CLASSIFY_CACHE_MAX_QUERY_LEN = 128
+
 
 class QueryClassifier:
     """
@@ -49,6 +53,14 @@ class QueryClassifier:
             'according to', 'in the document', 'what does it say',
             'summarize', 'explain this', 'tell me about this'
         ]
+        
+        # All greeting patterns folded into one precompiled alternation
+        self._greeting_re = re.compile('|'.join(f'(?:{p})' for p in self.greeting_patterns))
+        self._web_search_keywords = tuple(self.web_search_keywords)
+        self._document_keywords = tuple(self.document_keywords)
+        
+        # Per-instance memo of (normalized query, has_documents) -> result
+        self._classify_cached = lru_cache(maxsize=4096)(self._classify)
     
     def classify(self, query: str, has_documents: bool = False) -> Dict[str, any]:
         """
@@ -66,20 +78,27 @@ class QueryClassifier:
         """
         query_lower = query.lower().strip()
         
+        if len(query_lower) > CLASSIFY_CACHE_MAX_QUERY_LEN:
+            return self._classify(query_lower, has_documents)
+        
+        # Copy so callers can't mutate the cached result
+        return dict(self._classify_cached(query_lower, has_documents))
+    
+    def _classify(self, query_lower: str, has_documents: bool) -> Dict[str, any]:
+        """Classify an already lower-cased, stripped query"""
         # 1. Check for simple greetings
-        for pattern in self.greeting_patterns:
-            if re.match(pattern, query_lower):
-                return {
-                    'type': 'greeting',
-                    'confidence': 1.0,
-                    'reason': 'Matched greeting pattern'
-                }
+        if self._greeting_re.match(query_lower):
+            return {
+                'type': 'greeting',
+                'confidence': 1.0,
+                'reason': 'Matched greeting pattern'
+            }
         
         # 2. Check for web search indicators
-        web_score = sum(1 for keyword in self.web_search_keywords if keyword in query_lower)
+        web_score = sum(1 for keyword in self._web_search_keywords if keyword in query_lower)
         
         # 3. Check for document-specific keywords
-        doc_score = sum(1 for keyword in self.document_keywords if keyword in query_lower)
+        doc_score = sum(1 for keyword in self._document_keywords if keyword in query_lower)
         
         # Decision logic
         if not has_documents:
@@ -3,7 +3,7 @@ Semantic Text Chunking for RAG
 Intelligently splits text based on document structure and meaning
 """
 
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 import re
 import logging
 
@@ -131,13 +131,32 @@ class SemanticChunker:
         Returns:
             List of chunks with metadata
         """
-        all_chunks = []
-        doc_id = extraction_result.get('doc_id', 'unknown')
-        
         if strategy == "page_wise":
             # Page-wise chunking (one chunk per page with overlap)
             return self._chunk_page_wise(extraction_result)
         
+        all_chunks = list(self.iter_chunks(extraction_result))
+        
+        logger.info(f"Created {len(all_chunks)} semantic chunks from {len(extraction_result['pages'])} pages")
+        
+        return all_chunks
+    
+    def iter_chunks(self, extraction_result: Dict) -> Iterator[Dict]:
+        """
+        Semantic chunks of a PDF extraction result, yielded page by page
+        
+        Lets a consumer (e.g. PineconeEmbedder.embed_chunks) start on the
+        first chunks while later pages are still being chunked.
+        
+        Args:
+            extraction_result: PDF extraction result
+            
+        Yields:
+            Chunks with metadata and global 'chunk_id', in document order
+        """
+        doc_id = extraction_result.get('doc_id', 'unknown')
+        chunk_id = 0
+        
         # Semantic chunking (across page boundaries)
         for page in extraction_result['pages']:
             page_num = page['page_num']
@@ -164,17 +183,11 @@ class SemanticChunker:
                 'num_images': len(images)
             }
             
-            # Chunk the enhanced text
-            page_chunks = self.chunk_text(enhanced_text, metadata=page_metadata)
-            all_chunks.extend(page_chunks)
-        
-        # Add global chunk IDs
-        for idx, chunk in enumerate(all_chunks):
-            chunk['chunk_id'] = idx
-        
-        logger.info(f"Created {len(all_chunks)} semantic chunks from {len(extraction_result['pages'])} pages")
-        
-        return all_chunks
+            # Chunk the enhanced text, adding global chunk IDs
+            for chunk in self.chunk_text(enhanced_text, metadata=page_metadata):
+                chunk['chunk_id'] = chunk_id
+                chunk_id += 1
+                yield chunk
     
     def _chunk_page_wise(self, extraction_result: Dict) -> List[Dict]:
         """
@@ -301,7 +314,9 @@ def chunk_pdf_extraction(
     strategy: str = "semantic",
     max_chunk_size: int = 1500,
     min_chunk_size: int = 300,
-    generate_embeddings: bool = False
+    generate_embeddings: bool = False,
+    embedding_batch_size: int = 96,
+    embedding_concurrency: int = 4
 ) -> Dict:
     """
     Convenience function to chunk PDF extraction result
@@ -312,6 +327,8 @@ def chunk_pdf_extraction(
         max_chunk_size: Maximum chunk size
         min_chunk_size: Minimum chunk size
         generate_embeddings: Generate embeddings for chunks
+        embedding_batch_size: Chunks per embedding request (max 96 for Pinecone)
+        embedding_concurrency: Embedding requests in flight at once
         
     Returns:
         Extraction result with 'chunks' added
@@ -322,18 +339,29 @@ def chunk_pdf_extraction(
         overlap_sentences=2
     )
     
-    chunks = chunker.chunk_pdf_pages(extraction_result, strategy=strategy)
-    
     # Generate embeddings if requested
     if generate_embeddings:
         try:
             from app.utils.pinecone_embedder import get_embedder
-            logger.info(f"Generating embeddings for {len(chunks)} chunks...")
+            logger.info("Generating embeddings while chunking...")
             embedder = get_embedder()
-            chunks = embedder.embed_chunks(chunks)
-            logger.info(f"✓ Embeddings generated for all chunks")
+            # Semantic chunks are streamed into the embedder as they're made
+            if strategy == "page_wise":
+                source = chunker.chunk_pdf_pages(extraction_result, strategy=strategy)
+            else:
+                source = chunker.iter_chunks(extraction_result)
+            chunks = embedder.embed_chunks(
+                source,
+                batch_size=embedding_batch_size,
+                max_concurrency=embedding_concurrency
+            )
+            logger.info(f"✓ Embeddings generated for all {len(chunks)} chunks")
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
+            # Continue without embeddings
+            chunks = chunker.chunk_pdf_pages(extraction_result, strategy=strategy)
+    else:
+        chunks = chunker.chunk_pdf_pages(extraction_result, strategy=strategy)
     
     extraction_result['chunks'] = chunks
     extraction_result['total_chunks'] = len(chunks)
@@ -7,7 +7,8 @@ from supabase import create_client, Client
 from app.core.config import settings
 import logging
 from pathlib import Path
-from typing import Optional, Dict
+from typing import BinaryIO, Optional, Dict, Union
+import io
 import mimetypes
 
 logger = logging.getLogger(__name__)
@@ -64,22 +65,20 @@ class SupabaseStorage:
             Dict with 'path' and 'url' of uploaded file
         """
         try:
-            # Read file content
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
             # Auto-detect content type if not provided
             if content_type is None:
                 content_type, _ = mimetypes.guess_type(file_path)
                 if content_type is None:
                     content_type = 'application/octet-stream'
-            
-            # Upload to Supabase Storage
-            response = self.client.storage.from_(self.bucket_name).upload(
-                path=storage_path,
-                file=file_content,
-                file_options={"content-type": content_type, "upsert": "true"}
-            )
+
+            # Upload to Supabase Storage straight from the open file handle
+            # (streamed by the HTTP client instead of read into memory first)
+            with open(file_path, 'rb') as f:
+                response = self.client.storage.from_(self.bucket_name).upload(
+                    path=storage_path,
+                    file=f,
+                    file_options={"content-type": content_type, "upsert": "true"}
+                )
             
             # Construct public URL manually to ensure it's correct
             # Format: {SUPABASE_URL}/storage/v1/object/public/{bucket}/{path}
@@ -101,7 +100,7 @@ class SupabaseStorage:
     
     def upload_bytes(
         self,
-        file_bytes: bytes,
+        file_bytes: Union[bytes, BinaryIO],
         storage_path: str,
         content_type: str = 'application/octet-stream'
     ) -> Dict[str, str]:
@@ -109,7 +108,8 @@ class SupabaseStorage:
         Upload bytes directly to Supabase Storage
         
         Args:
-            file_bytes: File content as bytes
+            file_bytes: File content as bytes, or an in-memory binary stream
+                (e.g. io.BytesIO) that is sent as-is without a getvalue() copy
             storage_path: Path in storage bucket
             content_type: MIME type
             
@@ -117,6 +117,12 @@ class SupabaseStorage:
             Dict with 'path' and 'url' of uploaded file
         """
         try:
+            if not isinstance(file_bytes, (bytes, io.BufferedReader)):
+                # The storage client takes bytes or a reader; wrap streams so the
+                # HTTP client reads the body from them in chunks
+                file_bytes.seek(0)
+                file_bytes = io.BufferedReader(file_bytes)
+            
             # Upload to Supabase Storage
             response = self.client.storage.from_(self.bucket_name).upload(
                 path=storage_path,
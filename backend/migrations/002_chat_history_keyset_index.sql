@@ -0,0 +1,9 @@
+-- Keyset pagination index for chat_history
+-- Run this in Supabase SQL Editor (after 001_create_chat_history.sql)
+
+-- History pages are read newest-first by (created_at, id): messages saved in
+-- one insert share created_at, so id breaks the tie
+DROP INDEX IF EXISTS idx_chat_history_session;
+
+CREATE INDEX IF NOT EXISTS idx_chat_history_session 
+ON chat_history(session_id, created_at DESC, id DESC);